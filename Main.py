@@ -3,11 +3,24 @@
 import asyncio
 import logging
 
-import hypercorn.asyncio
-from chatbot import TelegramBot
-from database import create_tables
-from hypercorn.config import Config as HypercornConfig
-from webhook import app, set_webhook
+from startup import profiler, warm_up
+
+with profiler.phase("import server"):
+    import hypercorn.asyncio
+    from hypercorn.config import Config as HypercornConfig
+    from config import Config
+
+with profiler.phase("import bot"):
+    from chatbot import TelegramBot
+
+with profiler.phase("import webhook"):
+    import async_database
+    from database import create_tables
+    from document_extractor import document_extractor
+    from evaluation_worker import evaluation_worker
+    from http_client import close_http_client, start_http_client
+    from shard_router import shard_router
+    from webhook import app, register_metrics, set_webhook
 
 # Configurazione del logger
 logger = logging.getLogger("app")
@@ -15,20 +28,48 @@ logger.setLevel(logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
 
 
+@app.before_serving
+async def schedule_warm_up():
+    # Il warm-up parte in background: il server accetta i webhook senza attenderlo
+    if Config.FAST_STARTUP and Config.WARMUP:
+        app.add_background_task(warm_up)
+
+
 async def start_servers():
-    create_tables()
+    with profiler.phase("create tables"):
+        create_tables()
 
     hypercorn_config = HypercornConfig()
     hypercorn_config.bind = ["0.0.0.0:8000"]
-    set_webhook()
+    await start_http_client()
+    if shard_router.enabled:
+        # Le sessioni delle chat vengono elaborate da SHARD_WORKERS processi
+        with profiler.phase("start shard workers"):
+            shard_router.start()
+    with profiler.phase("set webhook"):
+        await set_webhook()
+
+    with profiler.phase("init bot"):
+        bot = TelegramBot()
+    register_metrics("daily_rollup", bot.daily_rollup.stats)
 
-    bot = TelegramBot()
+    if not Config.FAST_STARTUP:
+        # Avvio tradizionale: tutte le dipendenze vengono caricate prima di servire
+        await warm_up()
+    else:
+        profiler.report()
 
-    await asyncio.gather(
-        bot.start_bot(),
-        hypercorn.asyncio.serve(app, hypercorn_config)
-    )
+    try:
+        await asyncio.gather(
+            bot.start_bot(),
+            hypercorn.asyncio.serve(app, hypercorn_config)
+        )
+    finally:
+        await shard_router.stop()
+        await evaluation_worker.close()
+        document_extractor.close()
+        await close_http_client()
+        async_database.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(start_servers())
-
@@ -0,0 +1,133 @@
+# async_database.py
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from config import Config
+
+# Thread dedicati al database: le query SQLAlchemy sincrone non bloccano l'event loop
+_executor = ThreadPoolExecutor(max_workers=Config.DB_WORKERS, thread_name_prefix="db")
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Esegue una funzione sincrona di database.py nel DB executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+
+# Varianti asincrone con la stessa firma delle funzioni di database.py
+
+async def save_messages(chat_id, username, content, message_type="text", timestamp=None, caption=None):
+    return await run_in_db_executor(database.save_messages, chat_id, username, content, message_type, timestamp, caption)
+
+
+async def save_messages_bulk(chat_id, messages):
+    return await run_in_db_executor(database.save_messages_bulk, chat_id, messages)
+
+
+async def get_messages(chat_id, start=None, end=None, limit=None, after=None):
+    return await run_in_db_executor(database.get_messages, chat_id, start, end, limit, after)
+
+
+async def iter_messages(chat_id, start=None, end=None, batch_size=None):
+    """Versione asincrona di database.iter_messages: ogni pagina viene letta nel DB executor."""
+    batch_size = batch_size or Config.DB_MESSAGES_BATCH_SIZE
+    after = None
+    while True:
+        batch = await get_messages(chat_id, start, end, batch_size, after)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after = database.message_cursor(batch[-1])
+
+
+async def save_chat_preferences(chat_id, auto_summary, language, filter, summary_length, timezone=None, daily_hour=None):
+    return await run_in_db_executor(database.save_chat_preferences, chat_id, auto_summary, language, filter, summary_length, timezone, daily_hour)
+
+
+async def get_chat_preferences(chat_id):
+    return await run_in_db_executor(database.get_chat_preferences, chat_id)
+
+
+async def add_summary(chat_id, summary_content):
+    return await run_in_db_executor(database.add_summary, chat_id, summary_content)
+
+
+async def get_summary(chat_id, summary_date):
+    return await run_in_db_executor(database.get_summary, chat_id, summary_date)
+
+
+async def add_evaluation(chat_id, results):
+    return await run_in_db_executor(database.add_evaluation, chat_id, results)
+
+
+async def get_media_analysis(cache_key):
+    return await run_in_db_executor(database.get_media_analysis, cache_key)
+
+
+async def save_media_analysis(cache_key, media_type, result):
+    return await run_in_db_executor(database.save_media_analysis, cache_key, media_type, result)
+
+
+async def start_rollup(run_date, chat_ids):
+    return await run_in_db_executor(database.start_rollup, run_date, chat_ids)
+
+
+async def mark_rollup(run_date, chat_id, status, error=None):
+    return await run_in_db_executor(database.mark_rollup, run_date, chat_id, status, error)
+
+
+async def get_completed_rollups(run_date):
+    return await run_in_db_executor(database.get_completed_rollups, run_date)
+
+
+async def get_pending_rollups():
+    return await run_in_db_executor(database.get_pending_rollups)
+
+
+async def save_session_state(chat_id, current_summary, pending_messages):
+    return await run_in_db_executor(database.save_session_state, chat_id, current_summary, pending_messages)
+
+
+async def get_session_state(chat_id):
+    return await run_in_db_executor(database.get_session_state, chat_id)
+
+
+async def delete_session_state(chat_id):
+    return await run_in_db_executor(database.delete_session_state, chat_id)
+
+
+async def get_daily_schedules():
+    return await run_in_db_executor(database.get_daily_schedules)
+
+
+async def get_rollup_chat_ids(run_date):
+    return await run_in_db_executor(database.get_rollup_chat_ids, run_date)
+
+
+async def add_pending_update(chat_id, payload, update_id=None):
+    return await run_in_db_executor(database.add_pending_update, chat_id, payload, update_id)
+
+
+async def delete_pending_update(update_row_id):
+    return await run_in_db_executor(database.delete_pending_update, update_row_id)
+
+
+async def get_pending_updates():
+    return await run_in_db_executor(database.get_pending_updates)
+
+
+async def get_recent_update_ids(limit):
+    return await run_in_db_executor(database.get_recent_update_ids, limit)
+
+
+async def prune_seen_updates(keep):
+    return await run_in_db_executor(database.prune_seen_updates, keep)
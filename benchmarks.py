@@ -0,0 +1,115 @@
+# benchmarks.py
+
+import json
+import random
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from tabulate import tabulate
+
+from message_buffer import MessageBuffer, MessageRecord
+from models import FastUpdate, Update, loads
+
+# Update tipici ricevuti dal webhook
+TEXT_UPDATE = {
+    "update_id": 123456789,
+    "message": {
+        "message_id": 42,
+        "chat": {"id": -1001234567890, "type": "supergroup", "title": "Gruppo"},
+        "from": {"id": 987654321, "is_bot": False, "username": "mario", "first_name": "Mario", "last_name": "Rossi"},
+        "date": 1729245600,
+        "text": "Ciao a tutti, ci vediamo domani alle 10 per la riunione.",
+    },
+}
+
+PHOTO_UPDATE = {
+    "update_id": 123456790,
+    "message": {
+        "message_id": 43,
+        "chat": {"id": -1001234567890, "type": "supergroup", "title": "Gruppo"},
+        "from": {"id": 987654321, "is_bot": False, "username": "mario", "first_name": "Mario"},
+        "date": 1729245660,
+        "caption": "La lavagna di oggi",
+        "photo": [
+            {"file_id": f"AgACAgQAAx{size}", "file_unique_id": f"AQAD{size}", "file_size": size * 100,
+             "width": size, "height": size}
+            for size in (90, 320, 800, 1280)
+        ],
+    },
+}
+
+
+def pydantic_path(body):
+    update = Update(**json.loads(body))
+    return update.message.text, update.message.photo
+
+
+def fast_path(body):
+    update = FastUpdate(loads(body))
+    return update.message.text, update.message.photo
+
+
+def benchmark_decoding(number=20000):
+    """Confronta json + pydantic con il percorso veloce (orjson + record con __slots__)."""
+    rows = []
+    for name, payload in (("testo", TEXT_UPDATE), ("foto", PHOTO_UPDATE)):
+        body = json.dumps(payload).encode()
+        baseline = timeit.timeit(lambda: pydantic_path(body), number=number) / number
+        fast = timeit.timeit(lambda: fast_path(body), number=number) / number
+        rows.append([name, f"{baseline * 1e6:.1f}", f"{fast * 1e6:.1f}", f"{baseline / fast:.1f}x"])
+    print(tabulate(rows, headers=["Update", "pydantic (µs)", "veloce (µs)", "Speedup"]))
+
+
+def _measure(build):
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def benchmark_message_memory(count=100_000):
+    """Memoria occupata da 'count' messaggi: dizionari (prima) contro MessageBuffer di MessageRecord."""
+    users = [f"utente_{i}" for i in range(50)]
+    # Testi generati a parte: il contenuto è lo stesso nei due casi e non viene misurato
+    samples = [
+        (random.choice(users), "text", f"messaggio numero {i}", 1729245600 + i)
+        for i in range(count)
+    ]
+
+    def build_dicts():
+        messages, daily_messages = [], []
+        for username, message_type, content, timestamp in samples:
+            # Ogni messaggio ricevuto dal webhook ha un proprio oggetto stringa per lo username
+            message = {
+                'username': "".join(username),
+                'type': message_type,
+                'content': content,
+                'timestamp': datetime.fromtimestamp(timestamp),
+                'caption': "",
+                'file_unique_id': None
+            }
+            messages.append(message)
+            daily_messages.append(message)
+        return messages, daily_messages
+
+    def build_records():
+        buffer = MessageBuffer()
+        for username, message_type, content, timestamp in samples:
+            buffer.append(MessageRecord("".join(username), message_type, content, timestamp, ""))
+        return buffer, buffer.window(), buffer.unsaved()
+
+    _, dict_size = _measure(build_dicts)
+    _, record_size = _measure(build_records)
+    print(tabulate(
+        [["dict", f"{dict_size / 2**20:.1f}"], ["MessageRecord", f"{record_size / 2**20:.1f}"]],
+        headers=[f"{count} messaggi", "MiB"]
+    ))
+    print(f"Risparmio: {(dict_size - record_size) / 2**20:.1f} MiB ({1 - record_size / dict_size:.0%})")
+
+
+if __name__ == "__main__":
+    benchmark_decoding()
+    print()
+    benchmark_message_memory()
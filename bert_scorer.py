@@ -0,0 +1,53 @@
+# bert_scorer.py
+
+import logging
+import threading
+
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("bert_scorer")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+class ResidentBertScorer:
+    """Mantiene caricato il modello di BERTScore e valuta più coppie in un solo forward pass."""
+
+    def __init__(self, lang="it", model_type=None, batch_size=None):
+        self.lang = lang
+        self.model_type = model_type
+        self.batch_size = batch_size or Config.BERT_MAX_BATCH_SIZE
+        self._scorer = None
+        self._lock = threading.Lock()
+
+    def _get_scorer(self):
+        # Il modello viene risolto e caricato una sola volta per processo
+        if self._scorer is None:
+            with self._lock:
+                if self._scorer is None:
+                    from bert_score import BERTScorer
+                    logger.info("Caricamento del modello BERTScore...")
+                    self._scorer = BERTScorer(lang=self.lang, model_type=self.model_type, batch_size=self.batch_size)
+        return self._scorer
+
+    def score_batch(self, summaries, sources):
+        """Restituisce il F1 di BERTScore per ciascuna coppia (riassunto, testo originale)."""
+        if not summaries:
+            return []
+        _, _, F1 = self._get_scorer().score(list(summaries), list(sources))
+        return [value.item() for value in F1]
+
+    def score(self, summary, source):
+        return self.score_batch([summary], [source])[0]
+
+
+# Istanza residente condivisa all'interno del processo
+_resident_scorer = None
+
+
+def get_bert_scorer():
+    global _resident_scorer
+    if _resident_scorer is None:
+        _resident_scorer = ResidentBertScorer(lang="it")
+    return _resident_scorer
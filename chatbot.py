@@ -1,11 +1,13 @@
 # chatbot.py
 import asyncio
 import logging
-from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from config import Config
+from daily_rollup import DailyRollupRunner, DailyScheduler
 from localization import LANGUAGES
-from session_manager import SessionManager
+from openai_scheduler import Priority, request_priority
+from shard_router import get_session_manager
 from telethon import TelegramClient, events, Button
 
 # Configurazione del logger
@@ -19,11 +21,15 @@ class TelegramBot:
         self.api_hash = Config.API_HASH
         self.bot_token = Config.BOT_TOKEN
         self.client = TelegramClient('anon', api_id=self.api_id, api_hash=self.api_hash)
-        self.session_manager = SessionManager()
+        self.session_manager = get_session_manager()
+        self.daily_rollup = DailyRollupRunner(self.process_daily_summary)
+        self.daily_scheduler = DailyScheduler(self.session_manager, self.daily_rollup)
 
         # Gestori Eventi
         self.client.add_event_handler(self.handle_start_command, events.NewMessage(pattern='/start'))
         self.client.add_event_handler(self.handle_help_command, events.NewMessage(pattern='/help'))
+        self.client.add_event_handler(self.handle_daily_hour_command, events.NewMessage(pattern=r'/ora_riassunto(?:@\w+)?(?:\s+(\S+))?\s*$'))
+        self.client.add_event_handler(self.handle_timezone_command, events.NewMessage(pattern=r'/fuso_orario(?:@\w+)?(?:\s+(\S+))?\s*$'))
         self.client.add_event_handler(self.handle_text_message, events.NewMessage(incoming=True))
 
         # Gestore Pulsanti
@@ -69,7 +75,7 @@ class TelegramBot:
             },
             'auto_summary_menu': {
                 'text_key': 'auto_summary_menu_text',
-                'buttons': [('activate', 'yes_auto'), ('deactivate', 'no_auto')],
+                'buttons': [('activate', 'yes_auto'), ('deactivate', 'no_auto'), ('daily_schedule', 'daily_schedule')],
                 'previous': 'options_menu'
             },
             'summary_settings_menu': {
@@ -82,6 +88,8 @@ class TelegramBot:
     async def start_bot(self):
         await self.client.start(bot_token=self.bot_token)
         logger.info("Bot avviato con successo.")
+        # Riprende eventuali riassunti giornalieri interrotti da un riavvio
+        asyncio.create_task(self.daily_rollup.resume())
         await self.client.run_until_disconnected()
 
     # Handler per la gestione dei comandi
@@ -104,7 +112,8 @@ class TelegramBot:
         localization = LANGUAGES.get(language, LANGUAGES['it'])
 
         await event.respond(localization.get('processing_summary'))
-        summary = await user_session.get_summary()
+        with request_priority(Priority.INTERACTIVE):
+            summary = await user_session.get_summary()
         await event.respond(summary)
 
     async def handle_preferences_command(self, event):
@@ -117,6 +126,8 @@ class TelegramBot:
             "Lingua": await user_session.get_preference("Lingua"),
             "Filtro": await user_session.get_preference("Filtro"),
             "Lunghezza Riassunto": await user_session.get_preference("Lunghezza Riassunto"),
+            "Fuso Orario": await user_session.get_preference("Fuso Orario"),
+            "Ora Riassunto": await user_session.get_preference("Ora Riassunto"),
         }
 
         # Formatta le preferenze per la visualizzazione
@@ -137,6 +148,40 @@ class TelegramBot:
         help_text = localization.get('help_text', "Ecco la lista dei comandi:")
         await self.show_menu(event, 'main_menu', help_text)
 
+    # Orario del riassunto giornaliero: ora locale (0-23) e fuso orario IANA (es. Europe/Rome)
+    async def handle_daily_hour_command(self, event):
+        value = event.pattern_match.group(1)
+        if value is None or not value.isdigit() or not 0 <= int(value) <= 23:
+            await self.respond_localized(event, 'error_invalid_hour')
+            return
+        await self.update_schedule_preference(event, "Ora Riassunto", int(value))
+
+    async def handle_timezone_command(self, event):
+        value = event.pattern_match.group(1)
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError, TypeError):
+            await self.respond_localized(event, 'error_invalid_timezone')
+            return
+        await self.update_schedule_preference(event, "Fuso Orario", value)
+
+    async def update_schedule_preference(self, event, key, value):
+        chat_id = event.chat_id if hasattr(event, 'chat_id') else event.sender_id
+        user_session = await self.session_manager.get_session(chat_id)
+        language = await user_session.get_preference("Lingua") or 'it'
+        localization = LANGUAGES.get(language, LANGUAGES['it'])
+
+        await user_session.update_preference(key, value)
+        await self.daily_scheduler.preference_changed(chat_id, key, user_session)
+        await event.respond(localization.get('confirmation_update').format(key=localization.get(key.lower(), key), value=value))
+
+    async def respond_localized(self, event, text_key):
+        chat_id = event.chat_id if hasattr(event, 'chat_id') else event.sender_id
+        user_session = await self.session_manager.get_session(chat_id)
+        language = await user_session.get_preference("Lingua") or 'it'
+        localization = LANGUAGES.get(language, LANGUAGES['it'])
+        await event.respond(localization.get(text_key))
+
     async def handle_text_message(self, event):
         # Gestisce i messaggi di testo per impostare il filtro solo se `pending_filters` è attivo per quella chat e utente specifici.
         chat_id = event.chat_id if hasattr(event, 'chat_id') else event.sender_id
@@ -208,6 +253,7 @@ class TelegramBot:
         elif data in self.preference_mapping:
             key, value = self.preference_mapping[data]
             await user_session.update_preference(key, value)
+            await self.daily_scheduler.preference_changed(chat_id, key, user_session)
             confirmation_text = localization.get('confirmation_update', "Preferenza '{key}' aggiornata a '{value}'.")
             await event.answer(
                 confirmation_text.format(key=localization.get(key.lower(), key), value=localization.get(value, value)))
@@ -219,22 +265,22 @@ class TelegramBot:
         elif data == 'preferences':
             await self.handle_preferences_command(event)
 
+        elif data == 'daily_schedule':
+            await event.respond(localization.get('daily_schedule_help').format(
+                hour=await user_session.get_preference("Ora Riassunto"),
+                timezone=await user_session.get_preference("Fuso Orario")))
+
         elif data == 'filters':
             await event.respond(localization.get('set_filter_placeholder')) #da controllare
             user = await self.client.get_entity(user_id)
             await user_session.add_pending_filter(user.username)
 
     async def daily_summary_timer(self):
-        while True:
-            now = datetime.now()
-            next_run = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
-            delay = (next_run - now).total_seconds()
-            await asyncio.sleep(delay)
-
-            await self.send_daily_summary_to_all()
+        # Ogni chat riceve il riassunto nel proprio fuso orario, con partenze scaglionate
+        await self.daily_scheduler.run_forever()
 
-    async def send_daily_summary_to_all(self):
-        for chat_id in self.session_manager.sessions:
+    async def process_daily_summary(self, chat_id):
+        with request_priority(Priority.DAILY):
             session = await self.session_manager.get_session(chat_id)
             if await session.get_preference("Auto-Riassunto"):
                 summary_content = await session.get_summary()
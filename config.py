@@ -6,3 +6,112 @@ class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN", "default_bot_token")
     NGROK_URL = os.getenv("NGROK_URL", "https://default.ngrok.url")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "default_openai_api_key")
+
+    # Valutazione dei riassunti in background
+    EVAL_SAMPLE_RATE = float(os.getenv("EVAL_SAMPLE_RATE", "1.0"))  # Frazione di riassunti da valutare (0-1)
+    EVAL_MAX_BACKLOG = int(os.getenv("EVAL_MAX_BACKLOG", "100"))  # Valutazioni in coda oltre le quali si scarta
+    EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "1"))  # Processi dedicati alla valutazione
+    BERT_MAX_BATCH_SIZE = int(os.getenv("BERT_MAX_BATCH_SIZE", "16"))  # Coppie per singolo forward pass di BERTScore
+    BERT_MAX_WAIT = float(os.getenv("BERT_MAX_WAIT", "2.0"))  # Secondi di attesa massima per riempire un batch
+
+    # Avvio
+    FAST_STARTUP = os.getenv("FAST_STARTUP", "1") == "1"  # Rimanda il caricamento delle dipendenze pesanti
+    WARMUP = os.getenv("WARMUP", "1") == "1"  # Pre-carica le dipendenze dopo l'avvio del server
+
+    # Campionamento dei video
+    VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "20"))  # Budget di fotogrammi per video
+    VIDEO_FRAME_INTERVAL = float(os.getenv("VIDEO_FRAME_INTERVAL", "2.0"))  # Secondi tra due fotogrammi campionati
+    VIDEO_FRAME_MAX_SIDE = int(os.getenv("VIDEO_FRAME_MAX_SIDE", "768"))  # Lato massimo dei fotogrammi inviati
+    VIDEO_MIN_HASH_DISTANCE = int(os.getenv("VIDEO_MIN_HASH_DISTANCE", "6"))  # Distanza minima tra hash (bit su 64)
+
+    # Download dei media
+    MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(50 * 1024 * 1024)))  # Dimensione massima di un media
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))  # Byte per blocco in streaming
+    MEDIA_TEMP_DIR = os.getenv("MEDIA_TEMP_DIR") or None  # Cartella dei file temporanei (None = default di sistema)
+
+    # Client HTTP condiviso
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))  # Secondi
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))  # Secondi per lettura/scrittura
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))  # Secondi
+
+    # Cache delle analisi dei media
+    MEDIA_CACHE_SIZE = int(os.getenv("MEDIA_CACHE_SIZE", "1000"))  # Voci mantenute nella LRU in memoria
+
+    # Riassunto gerarchico (map-reduce) delle conversazioni lunghe
+    SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))  # Token per segmento
+    SUMMARY_CHUNK_MAX_TOKENS = int(os.getenv("SUMMARY_CHUNK_MAX_TOKENS", "400"))  # Token di output per segmento
+    SUMMARY_MAX_PASSES = int(os.getenv("SUMMARY_MAX_PASSES", "4"))  # Passaggi massimi del riassunto gerarchico
+    SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))  # Segmenti riassunti in parallelo
+
+    # Budget di token in input per lunghezza del riassunto
+    PROMPT_BUDGET_BREVE = int(os.getenv("PROMPT_BUDGET_BREVE", "4000"))
+    PROMPT_BUDGET_MEDIO = int(os.getenv("PROMPT_BUDGET_MEDIO", "8000"))
+    PROMPT_BUDGET_LUNGO = int(os.getenv("PROMPT_BUDGET_LUNGO", "16000"))
+    PROMPT_MEDIA_DESCRIPTION_TOKENS = int(os.getenv("PROMPT_MEDIA_DESCRIPTION_TOKENS", "80"))  # Token per descrizione media
+
+    # Servizio NLP condiviso
+    NLP_MAX_CONCURRENCY = int(os.getenv("NLP_MAX_CONCURRENCY", "16"))  # Richieste OpenAI contemporanee nel processo
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))  # Connessioni del pool verso OpenAI
+
+    # Scheduler delle richieste OpenAI
+    OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))  # Richieste al minuto
+    OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))  # Token al minuto (stimati in input + output massimo)
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))  # Tentativi per errori 429 e transitori
+    OPENAI_IMAGE_TOKENS = int(os.getenv("OPENAI_IMAGE_TOKENS", "85"))  # Stima dei token per immagine in input
+
+    # Riassunti giornalieri
+    DAILY_ROLLUP_WORKERS = int(os.getenv("DAILY_ROLLUP_WORKERS", "8"))  # Chat elaborate in parallelo
+    DAILY_ROLLUP_HISTORY = int(os.getenv("DAILY_ROLLUP_HISTORY", "7"))  # Giornate di riassunti mostrate in /metrics
+
+    # Database
+    DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # Attesa massima su un database bloccato
+    DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16000"))  # Cache delle pagine di SQLite
+    DB_LOG_SAMPLE_RATE = float(os.getenv("DB_LOG_SAMPLE_RATE", "0.01"))  # Frazione dei messaggi salvati registrata nel log
+    DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))  # Thread dedicati alle operazioni sul database
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # Connessioni mantenute nel pool
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))  # Connessioni aggiuntive temporanee
+    DB_MESSAGES_BATCH_SIZE = int(os.getenv("DB_MESSAGES_BATCH_SIZE", "500"))  # Messaggi per pagina nelle letture a blocchi
+
+    # Sessioni in memoria
+    SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", "5000"))  # Sessioni mantenute in memoria
+    SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(30 * 60)))  # Secondi di inattività prima della rimozione
+    SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))  # Secondi tra due controlli
+
+    # Pianificazione dei riassunti giornalieri
+    DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Rome")  # Fuso orario delle chat senza preferenza
+    DEFAULT_DAILY_HOUR = int(os.getenv("DEFAULT_DAILY_HOUR", "0"))  # Ora locale predefinita del riassunto
+    DAILY_SPREAD_WINDOW = int(os.getenv("DAILY_SPREAD_WINDOW", "3600"))  # Secondi su cui distribuire le chat
+    DAILY_SCHEDULER_TICK = float(os.getenv("DAILY_SCHEDULER_TICK", "60"))  # Secondi in cui le scadenze vicine vengono raggruppate
+    DAILY_RESYNC_INTERVAL = float(os.getenv("DAILY_RESYNC_INTERVAL", "3600"))  # Secondi tra due riletture degli orari dal database
+    DAILY_MISSED_GRACE = int(os.getenv("DAILY_MISSED_GRACE", "3600"))  # Ritardo massimo con cui un riassunto parte ancora
+
+    # Coda degli update del webhook
+    UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))  # Worker paralleli; una chat è servita da un worker alla volta
+    UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))  # Update in attesa per chat prima di rifiutarne altri
+    UPDATE_QUEUE_TOTAL = int(os.getenv("UPDATE_QUEUE_TOTAL", "20000"))  # Update in attesa in totale prima di rifiutarne altri
+    UPDATE_RETRY_AFTER = int(os.getenv("UPDATE_RETRY_AFTER", "5"))  # Secondi suggeriti a Telegram quando la coda è piena
+    UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))  # update_id ricordati per scartare le riconsegne
+    STRICT_UPDATE_VALIDATION = os.getenv("STRICT_UPDATE_VALIDATION", "0") == "1"  # Valida gli update con pydantic
+
+    # Suddivisione delle chat tra processi worker
+    SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))  # Processi worker; 0 elabora tutto nel processo principale
+    SHARD_HEALTH_INTERVAL = float(os.getenv("SHARD_HEALTH_INTERVAL", "1"))  # Secondi tra due controlli dei worker
+    SHARD_MAX_ATTEMPTS = int(os.getenv("SHARD_MAX_ATTEMPTS", "3"))  # Tentativi di una richiesta se il worker termina
+    SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))  # Secondi concessi a un worker per salvare le sessioni
+    SHARD_CHECKPOINT_INTERVAL = float(os.getenv("SHARD_CHECKPOINT_INTERVAL", "60"))  # Secondi tra due salvataggi delle sessioni di un worker
+
+    # Estrazione del testo dai documenti
+    DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", "2"))  # Processi di estrazione a lunga vita, un documento alla volta ciascuno
+    DOCUMENT_TIMEOUT = float(os.getenv("DOCUMENT_TIMEOUT", "30"))  # Secondi massimi per documento
+    DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(20 * 1024 * 1024)))  # Dimensione massima di un documento
+    DOCUMENT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_TOKEN_BUDGET", "6000"))  # Token di testo estratti al massimo
+    DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "64"))  # Documenti estratti mantenuti in memoria
+
+    # Separazione di audio e fotogrammi dei video
+    FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")  # Eseguibile ffmpeg; senza, si usano moviepy e OpenCV
+    FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")  # Eseguibile ffprobe
+    VIDEO_AUDIO_SAMPLE_RATE = int(os.getenv("VIDEO_AUDIO_SAMPLE_RATE", "16000"))  # Hz dell'audio inviato alla trascrizione
+    VIDEO_AUDIO_BITRATE = os.getenv("VIDEO_AUDIO_BITRATE", "32k")  # Bitrate dell'audio mono inviato alla trascrizione
+    VIDEO_DEMUX_TIMEOUT = float(os.getenv("VIDEO_DEMUX_TIMEOUT", "120"))  # Secondi massimi per separare un video
@@ -0,0 +1,236 @@
+# daily_rollup.py
+
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import date, datetime, time as day_time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import Config
+from deadline_scheduler import DeadlineScheduler
+from async_database import get_completed_rollups, get_pending_rollups, get_rollup_chat_ids, mark_rollup, start_rollup
+
+# Configurazione del logger
+logger = logging.getLogger("daily_rollup")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Preferenze che cambiano l'orario del riassunto giornaliero
+SCHEDULE_PREFERENCES = frozenset({"Auto-Riassunto", "Fuso Orario", "Ora Riassunto"})
+
+
+class DailyRollupRunner:
+    """
+    Esegue i riassunti giornalieri in parallelo con un numero limitato di worker.
+
+    Lo stato di ogni chat viene registrato nella tabella daily_rollups: un errore resta confinato
+    alla chat che lo ha generato e, se il processo si riavvia a metà, resume() riprende dalle chat
+    non ancora completate.
+    """
+
+    def __init__(self, handler, workers=None):
+        self.handler = handler  # Coroutine che elabora il riassunto giornaliero di una chat
+        self.workers = workers or Config.DAILY_ROLLUP_WORKERS
+        # Limite condiviso da tutte le esecuzioni, anche se sovrapposte
+        self.slots = asyncio.Semaphore(self.workers)
+        self.progress = {}  # run_date -> avanzamento; le esecuzioni sovrapposte non si sovrascrivono
+
+    async def run(self, chat_ids, run_date=None):
+        run_date = run_date or date.today()
+        chat_ids = list(dict.fromkeys(chat_ids))
+        await start_rollup(run_date, chat_ids)
+        completed = await get_completed_rollups(run_date)
+        pending = [chat_id for chat_id in chat_ids if chat_id not in completed]
+        await self._run_pending(run_date, pending, already_done=len(chat_ids) - len(pending))
+
+    async def resume(self):
+        """Riprende le esecuzioni interrotte da un riavvio."""
+        for run_date, chat_ids in (await get_pending_rollups()).items():
+            logger.info(f"Ripresa del riassunto giornaliero del {run_date}: {len(chat_ids)} chat da completare.")
+            completed = await get_completed_rollups(run_date)
+            await self._run_pending(run_date, chat_ids, already_done=len(completed))
+
+    def _progress_for(self, run_date, chat_count, already_done):
+        progress = self.progress.get(run_date)
+        if progress is None:
+            progress = {
+                "run_date": run_date.isoformat(),
+                "total": already_done,
+                "done": already_done,
+                "failed": 0,
+                "started_at": time.monotonic(),
+            }
+            self.progress[run_date] = progress
+            # Solo le giornate più recenti restano nelle statistiche
+            for old_date in sorted(self.progress)[:-Config.DAILY_ROLLUP_HISTORY]:
+                del self.progress[old_date]
+        progress["total"] += chat_count
+        return progress
+
+    async def _run_pending(self, run_date, chat_ids, already_done=0):
+        progress = self._progress_for(run_date, len(chat_ids), already_done)
+        queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        workers = [asyncio.create_task(self._worker(run_date, queue, progress)) for _ in range(min(self.workers, len(chat_ids)))]
+        await asyncio.gather(*workers)
+
+        elapsed = time.monotonic() - progress["started_at"]
+        logger.info(
+            f"Riassunto giornaliero del {run_date} completato in {elapsed:.1f} s: "
+            f"{progress['done']}/{progress['total']} chat riuscite, {progress['failed']} fallite."
+        )
+
+    async def _worker(self, run_date, queue, progress):
+        while not queue.empty():
+            chat_id = queue.get_nowait()
+            try:
+                async with self.slots:
+                    await self.handler(chat_id)
+                await mark_rollup(run_date, chat_id, "done")
+                progress["done"] += 1
+            except Exception as e:
+                progress["failed"] += 1
+                logger.error(f"Errore nel riassunto giornaliero della chat {chat_id}: {e}")
+                await mark_rollup(run_date, chat_id, "failed", str(e))
+            self._log_progress(progress)
+
+    def _log_progress(self, progress):
+        processed = progress["done"] + progress["failed"]
+        step = max(1, progress["total"] // 10)
+        if processed % step == 0 or processed == progress["total"]:
+            logger.info(f"Riassunto giornaliero {progress['run_date']}: {processed}/{progress['total']} chat elaborate.")
+
+    def stats(self):
+        return {
+            run_date.isoformat(): {key: value for key, value in progress.items() if key not in ("run_date", "started_at")}
+            for run_date, progress in sorted(self.progress.items())
+        }
+
+
+def get_timezone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        logger.warning(f"Fuso orario non valido '{name}', uso {Config.DEFAULT_TIMEZONE}.")
+        return ZoneInfo(Config.DEFAULT_TIMEZONE)
+
+
+def scheduled_time(chat_id, local_date, tz, hour, window=None):
+    """Istante del riassunto di una chat: ora preferita più uno scostamento stabile entro la finestra."""
+    window = Config.DAILY_SPREAD_WINDOW if window is None else window
+    digest = hashlib.blake2b(f"{chat_id}:{local_date.isoformat()}".encode(), digest_size=8).digest()
+    jitter = int.from_bytes(digest, "big") % max(1, int(window))
+    return datetime.combine(local_date, day_time(hour % 24), tzinfo=tz) + timedelta(seconds=jitter)
+
+
+class DailyScheduler:
+    """
+    Pianifica i riassunti giornalieri di ogni chat nel suo fuso orario e alla sua ora preferita.
+
+    La prossima scadenza di ogni chat è in un DeadlineScheduler dedicato: un unico task dorme fino
+    alla più vicina e cambiare le preferenze di una chat costa O(log n). Le chat vengono distribuite
+    su DAILY_SPREAD_WINDOW secondi con uno scostamento deterministico; quelle che scadono entro
+    DAILY_SCHEDULER_TICK secondi partono insieme e le esecuzioni contemporanee restano limitate dal
+    DailyRollupRunner.
+    """
+
+    def __init__(self, session_manager, runner, batch_window=None, resync_interval=None):
+        self.session_manager = session_manager
+        self.runner = runner
+        self.batch_window = Config.DAILY_SCHEDULER_TICK if batch_window is None else batch_window
+        self.resync_interval = resync_interval or Config.DAILY_RESYNC_INTERVAL
+        self.deadlines = DeadlineScheduler()
+        self.schedules = {}  # chat_id -> (fuso orario, ora) pianificati
+        self.due = {}  # data locale -> chat scadute in attesa del prossimo gruppo
+        self.flush_task = None
+        self.in_progress = set()
+
+    async def run_forever(self):
+        # Le preferenze cambiate dai comandi arrivano con preference_changed; la risincronizzazione
+        # periodica raccoglie le chat nuove e le modifiche fatte da altri processi
+        while True:
+            try:
+                await self.resync()
+            except Exception as e:
+                logger.error(f"Errore nella pianificazione dei riassunti giornalieri: {e}")
+            await asyncio.sleep(self.resync_interval)
+
+    async def resync(self, now=None):
+        schedules = await self.session_manager.get_daily_schedules()
+        for chat_id in set(self.schedules) - set(schedules):
+            self.unplan(chat_id)
+        for chat_id, (tz_name, hour) in schedules.items():
+            if self.schedules.get(chat_id) != (tz_name, hour):
+                self.plan(chat_id, tz_name, hour, now)
+
+    async def preference_changed(self, chat_id, key, session):
+        if key not in SCHEDULE_PREFERENCES:
+            return
+        if await session.get_preference("Auto-Riassunto"):
+            self.plan(chat_id, await session.get_preference("Fuso Orario"), await session.get_preference("Ora Riassunto"))
+        else:
+            self.unplan(chat_id)
+
+    def plan(self, chat_id, tz_name, hour, now=None):
+        """Pianifica (o sposta) il prossimo riassunto della chat."""
+        now = now or datetime.now(timezone.utc)
+        tz = get_timezone(tz_name)
+        local_date = now.astimezone(tz).date()
+        # Le scadenze perse da più di DAILY_MISSED_GRACE (es. durante un fermo) non vengono recuperate
+        if now >= scheduled_time(chat_id, local_date, tz, hour) + timedelta(seconds=Config.DAILY_MISSED_GRACE):
+            local_date += timedelta(days=1)
+        self.schedules[chat_id] = (tz_name, hour)
+        self._schedule(chat_id, local_date, now)
+
+    def unplan(self, chat_id):
+        self.schedules.pop(chat_id, None)
+        self.deadlines.cancel(chat_id)
+
+    def _schedule(self, chat_id, local_date, now=None):
+        tz_name, hour = self.schedules[chat_id]
+        scheduled = scheduled_time(chat_id, local_date, get_timezone(tz_name), hour)
+        delay = (scheduled - (now or datetime.now(timezone.utc))).total_seconds()
+
+        async def on_due():
+            self._on_due(chat_id, local_date)
+        self.deadlines.schedule(chat_id, max(0.0, delay), on_due)
+
+    def _on_due(self, chat_id, run_date):
+        self.due.setdefault(run_date, set()).add(chat_id)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush())
+        # Il giorno successivo viene pianificato subito, con lo scostamento di quella data
+        if chat_id in self.schedules:
+            self._schedule(chat_id, run_date + timedelta(days=1))
+
+    async def _flush(self):
+        # Le scadenze vicine diventano un'unica esecuzione: una sola lettura dello stato per gruppo
+        while self.due:
+            await asyncio.sleep(self.batch_window)
+            due, self.due = self.due, {}
+            for run_date, chat_ids in sorted(due.items()):
+                try:
+                    registered = await get_rollup_chat_ids(run_date)
+                except Exception as e:
+                    logger.error(f"Errore nella lettura dei riassunti giornalieri del {run_date}: {e}")
+                    continue
+                pending = [chat_id for chat_id in sorted(chat_ids) if chat_id not in registered and (run_date, chat_id) not in self.in_progress]
+                if pending:
+                    asyncio.create_task(self._run(run_date, pending))
+
+    async def _run(self, run_date, chat_ids):
+        keys = {(run_date, chat_id) for chat_id in chat_ids}
+        self.in_progress.update(keys)
+        try:
+            await self.runner.run(chat_ids, run_date)
+        except Exception as e:
+            logger.error(f"Errore nel riassunto giornaliero del {run_date}: {e}")
+        finally:
+            self.in_progress.difference_update(keys)
+
+    def stats(self):
+        return {"scheduled": len(self.schedules), "waiting": sum(len(chat_ids) for chat_ids in self.due.values()),
+                "in_progress": len(self.in_progress), "fired": self.deadlines.fired}
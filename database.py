@@ -1,8 +1,18 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, inspect, insert, text, tuple_, Column, Integer, String, Text, Date, DateTime, Boolean, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, date
 import json
+import logging
+import random
+
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("database")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 
 
 # Definisce il modello di base per SQLAlchemy
@@ -19,6 +29,11 @@ class Message(Base):
     timestamp = Column(DateTime, default=datetime.now)  # Data e ora del messaggio
     caption = Column(String) # caption
 
+    # Indice composto per le letture della cronologia di una chat in ordine temporale
+    __table_args__ = (
+        Index('ix_messages_chat_id_timestamp', 'chat_id', 'timestamp', 'message_id'),
+    )
+
 
 # Tabella per memorizzare le preferenze delle chat
 class ChatPreference(Base):
@@ -28,6 +43,8 @@ class ChatPreference(Base):
     language = Column(String)  # Lingua preferita
     filter = Column(String)  # Filtro
     summary_length = Column(String)  # Lunghezza del riassunto
+    timezone = Column(String)  # Fuso orario della chat (es. "Europe/Rome")
+    daily_hour = Column(Integer)  # Ora locale preferita per il riassunto giornaliero
 
 
 # Tabella per memorizzare i riassunti giornalieri
@@ -39,16 +56,104 @@ class Summary(Base):
     summary_date = Column(Date, default=date.today)  # Data del riassunto
 
 
+# Tabella per memorizzare le metriche di qualità dei riassunti
+class SummaryEvaluation(Base):
+    __tablename__ = 'summary_evaluations'
+    evaluation_id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(Integer, index=True)  # Identificatore della chat (può mancare)
+    rouge_1 = Column(Float)
+    rouge_2 = Column(Float)
+    rouge_l = Column(Float)
+    bert_score = Column(Float)
+    keywords_score = Column(Float)  # Similarità di Jaccard delle parole chiave
+    created_at = Column(DateTime, default=datetime.now)  # Data e ora della valutazione
+
+
+# Tabella per memorizzare in cache i risultati dell'analisi dei media
+class MediaAnalysis(Base):
+    __tablename__ = 'media_analyses'
+    cache_key = Column(String, primary_key=True)  # file_unique_id di Telegram o hash del contenuto
+    media_type = Column(String)  # Tipo di media analizzato
+    result = Column(Text)  # Descrizione o trascrizione prodotta
+    created_at = Column(DateTime, default=datetime.now)  # Data e ora dell'analisi
+
+
+# Tabella per lo stato dei riassunti giornalieri di ciascuna chat
+class DailyRollup(Base):
+    __tablename__ = 'daily_rollups'
+    run_date = Column(Date, primary_key=True)  # Giorno del riassunto
+    chat_id = Column(Integer, primary_key=True)  # Identificatore della chat
+    status = Column(String, default="pending")  # pending, done o failed
+    error = Column(Text)  # Ultimo errore, se fallito
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# Tabella per lo stato delle sessioni rimosse dalla memoria
+class SessionState(Base):
+    __tablename__ = 'session_states'
+    chat_id = Column(Integer, primary_key=True)  # Identificatore della chat
+    current_summary = Column(Text)  # Riassunto corrente della sessione
+    pending_messages = Column(Text)  # Messaggi non ancora riassunti (JSON)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# Tabella degli update del webhook ricevuti ma non ancora elaborati
+class PendingUpdate(Base):
+    __tablename__ = 'pending_updates'
+    id = Column(Integer, primary_key=True, autoincrement=True)  # Ordine di arrivo
+    chat_id = Column(Integer, index=True)  # Identificatore della chat
+    payload = Column(Text)  # Update di Telegram (JSON)
+    received_at = Column(DateTime, default=datetime.now)
+
+
+# Tabella degli update_id già ricevuti, per scartare le riconsegne di Telegram
+class SeenUpdate(Base):
+    __tablename__ = 'seen_updates'
+    update_id = Column(Integer, primary_key=True, autoincrement=False)  # update_id di Telegram
+    seen_at = Column(DateTime, default=datetime.now)
+
+
 # Crea il motore SQLite (database salvato in un file chiamato 'chatbot.db')
-engine = create_engine('sqlite:///chatbot.db')
+# Il pool consente a più thread del DB executor di usare connessioni distinte
+engine = create_engine(
+    'sqlite:///chatbot.db',
+    connect_args={"check_same_thread": False},
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+)
+
+
+# Imposta WAL e pragmi adatti a molte scritture brevi su ogni nuova connessione
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={Config.DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA cache_size=-{Config.DB_CACHE_SIZE_KB}")
+    cursor.close()
 
-# Crea una sessione per interagire con il database
+# Crea la factory delle sessioni: ogni operazione usa una propria sessione
 Session = sessionmaker(bind=engine)
-session = Session()
 
 # Funzione per creare tutte le tabelle
 def create_tables():
     Base.metadata.create_all(engine)
+    # create_all non aggiunge indici e colonne alle tabelle già esistenti
+    for index in Message.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    add_missing_columns(ChatPreference)
+
+
+def add_missing_columns(model):
+    """Aggiunge con ALTER TABLE le colonne introdotte dopo la creazione della tabella."""
+    existing = {column['name'] for column in inspect(engine).get_columns(model.__tablename__)}
+    with engine.begin() as connection:
+        for column in model.__table__.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                connection.execute(text(f'ALTER TABLE {model.__tablename__} ADD COLUMN {column.name} {column_type}'))
 
 # Funzione per salvare un messaggio
 def save_messages(chat_id, username, content, message_type="text", timestamp=None, caption=None):
@@ -64,63 +169,320 @@ def save_messages(chat_id, username, content, message_type="text", timestamp=Non
     with Session() as session:
         session.add(new_message)
         session.commit()
-    print(f"Messaggio salvato: chat_id={chat_id}, username={username}, content={content}, type={message_type}")
+    log_saved_message(chat_id, username, message_type)
+
+
+# Funzione per salvare in blocco i messaggi di una chat
+def save_messages_bulk(chat_id, messages):
+    """Salva una lista di messaggi nel formato della cache con un'unica transazione (executemany)."""
+    rows = [
+        {
+            'chat_id': chat_id,
+            'username': message['username'],
+            'message_type': message['type'],
+            'content': message['content'],
+            'timestamp': message['timestamp'],
+            'caption': message['caption'],
+        }
+        for message in messages
+    ]
+    if not rows:
+        return 0
+    with Session() as session:
+        session.execute(insert(Message), rows)
+        session.commit()
+    for row in rows:
+        log_saved_message(chat_id, row['username'], row['message_type'])
+    logger.info(f"Salvati {len(rows)} messaggi per la chat {chat_id}.")
+    return len(rows)
+
+
+def log_saved_message(chat_id, username, message_type):
+    # Registra solo una frazione dei messaggi, senza il contenuto
+    if random.random() < Config.DB_LOG_SAMPLE_RATE:
+        logger.debug(f"Messaggio salvato: chat_id={chat_id}, username={username}, type={message_type}")
 
 
 # Funzione per recuperare i messaggi di una chat
-def get_messages(chat_id):
-    """Recupera i messaggi dal database nel formato della cache."""
-    messages = session.query(Message).filter_by(chat_id=chat_id).order_by(Message.timestamp).all()
-    return [{'username': msg.username, 'type': msg.message_type, 'content': msg.content} for msg in messages]
+def get_messages(chat_id, start=None, end=None, limit=None, after=None):
+    """
+    Recupera i messaggi dal database nel formato della cache, in ordine cronologico.
+
+    - start / end: intervallo temporale [start, end) opzionale.
+    - limit: numero massimo di messaggi restituiti.
+    - after: cursore (timestamp, message_id) dell'ultimo messaggio della pagina precedente.
+    """
+    with Session() as session:
+        query = session.query(
+            Message.message_id, Message.username, Message.message_type,
+            Message.content, Message.timestamp, Message.caption
+        ).filter(Message.chat_id == chat_id)
+        if start is not None:
+            query = query.filter(Message.timestamp >= start)
+        if end is not None:
+            query = query.filter(Message.timestamp < end)
+        if after is not None:
+            query = query.filter(tuple_(Message.timestamp, Message.message_id) > tuple_(*after))
+        query = query.order_by(Message.timestamp, Message.message_id)
+        if limit is not None:
+            query = query.limit(limit)
+        return [
+            {
+                'message_id': row.message_id,
+                'username': row.username,
+                'type': row.message_type,
+                'content': row.content,
+                'timestamp': row.timestamp,
+                'caption': row.caption,
+            }
+            for row in query
+        ]
+
+
+def message_cursor(message):
+    """Cursore di paginazione per riprendere dopo il messaggio indicato."""
+    return (message['timestamp'], message['message_id'])
+
+
+# Funzione per scorrere i messaggi di una chat a blocchi di dimensione fissa
+def iter_messages(chat_id, start=None, end=None, batch_size=None):
+    """Generatore che restituisce liste di al più batch_size messaggi, con paginazione keyset."""
+    batch_size = batch_size or Config.DB_MESSAGES_BATCH_SIZE
+    after = None
+    while True:
+        batch = get_messages(chat_id, start, end, batch_size, after)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after = message_cursor(batch[-1])
 
 
 # Funzione per salvare le preferenze di una chat
-def save_chat_preferences(chat_id, auto_summary, language, filter, summary_length):
-    # Controlla se esistono già preferenze per questa chat
-    preference = session.query(ChatPreference).get(chat_id)
-
-    if preference:
-        # Aggiorna le preferenze esistenti
-        preference.auto_summary = auto_summary
-        preference.language = language
-        preference.filter = filter
-        preference.summary_length = summary_length
-    else:
-        # Crea nuove preferenze
-        new_preference = ChatPreference(
-            chat_id=chat_id,
-            auto_summary=auto_summary,
-            language=language,
-            filter=filter,
-            summary_length=summary_length)
-        session.add(new_preference)
-
-    session.commit()
+def save_chat_preferences(chat_id, auto_summary, language, filter, summary_length, timezone=None, daily_hour=None):
+    with Session() as session:
+        # Controlla se esistono già preferenze per questa chat
+        preference = session.get(ChatPreference, chat_id)
+
+        if preference:
+            # Aggiorna le preferenze esistenti
+            preference.auto_summary = auto_summary
+            preference.language = language
+            preference.filter = filter
+            preference.summary_length = summary_length
+            preference.timezone = timezone
+            preference.daily_hour = daily_hour
+        else:
+            # Crea nuove preferenze
+            new_preference = ChatPreference(
+                chat_id=chat_id,
+                auto_summary=auto_summary,
+                language=language,
+                filter=filter,
+                summary_length=summary_length,
+                timezone=timezone,
+                daily_hour=daily_hour)
+            session.add(new_preference)
+
+        session.commit()
 
 
 # Funzione per recuperare le preferenze di una chat
 def get_chat_preferences(chat_id):
-    preference = session.query(ChatPreference).get(chat_id)
-    if preference:
-        return {
-            'Auto-Riassunto': preference.auto_summary,
-            'Lingua': preference.language,
-            'Filtro': preference.filter,
-            'Lunghezza Riassunto': preference.summary_length
-        }
+    with Session() as session:
+        preference = session.get(ChatPreference, chat_id)
+        if preference:
+            return {
+                'Auto-Riassunto': preference.auto_summary,
+                'Lingua': preference.language,
+                'Filtro': preference.filter,
+                'Lunghezza Riassunto': preference.summary_length,
+                'Fuso Orario': preference.timezone or Config.DEFAULT_TIMEZONE,
+                'Ora Riassunto': Config.DEFAULT_DAILY_HOUR if preference.daily_hour is None else preference.daily_hour
+            }
     return None
 
 # Funzione per aggiungere un riassunto giornaliero
 def add_summary(chat_id, summary_content):
     #Aggiunge un nuovo riassunto giornaliero per una chat.
     new_summary = Summary(chat_id=chat_id, summary_content=summary_content, summary_date=date.today())
-    session.add(new_summary)
-    session.commit()
+    with Session() as session:
+        session.add(new_summary)
+        session.commit()
 
 # Funzione per recuperare un riassunto giornaliero per una specifica chat e data
 def get_summary(chat_id, summary_date):
     #Recupera il riassunto di una chat per una data specifica.
-    summary = session.query(Summary).filter_by(chat_id=chat_id, summary_date=summary_date).first()
-    return summary.summary_content if summary else None
+    with Session() as session:
+        summary = session.query(Summary).filter_by(chat_id=chat_id, summary_date=summary_date).first()
+        return summary.summary_content if summary else None
+
+
+# Funzione per salvare le metriche di qualità di un riassunto
+def add_evaluation(chat_id, results):
+    """Salva i risultati di SummaryEvaluator.compute_all per una chat."""
+    rouge = results["rouge"]
+    new_evaluation = SummaryEvaluation(
+        chat_id=chat_id,
+        rouge_1=rouge["ROUGE-1"],
+        rouge_2=rouge["ROUGE-2"],
+        rouge_l=rouge["ROUGE-L"],
+        bert_score=results["bert_score"],
+        keywords_score=results["keywords_score"]
+    )
+    with Session() as session:
+        session.add(new_evaluation)
+        session.commit()
+
 
+# Funzione per recuperare l'analisi in cache di un media
+def get_media_analysis(cache_key):
+    with Session() as session:
+        analysis = session.get(MediaAnalysis, cache_key)
+        return analysis.result if analysis else None
+
+
+# Funzione per salvare l'analisi di un media
+def save_media_analysis(cache_key, media_type, result):
+    with Session() as session:
+        session.merge(MediaAnalysis(cache_key=cache_key, media_type=media_type, result=result))
+        session.commit()
+
+
+# Funzione per registrare le chat di un riassunto giornaliero
+def start_rollup(run_date, chat_ids):
+    """Registra come 'pending' le chat non ancora presenti per la data indicata."""
+    with Session() as session:
+        existing = {row.chat_id for row in session.query(DailyRollup.chat_id).filter_by(run_date=run_date)}
+        session.add_all([DailyRollup(run_date=run_date, chat_id=chat_id) for chat_id in chat_ids if chat_id not in existing])
+        session.commit()
+
+
+# Funzione per aggiornare lo stato del riassunto giornaliero di una chat
+def mark_rollup(run_date, chat_id, status, error=None):
+    with Session() as session:
+        session.merge(DailyRollup(run_date=run_date, chat_id=chat_id, status=status, error=error))
+        session.commit()
+
+
+# Funzione per recuperare le chat già completate in una data
+def get_completed_rollups(run_date):
+    with Session() as session:
+        rows = session.query(DailyRollup.chat_id).filter_by(run_date=run_date, status="done")
+        return {row.chat_id for row in rows}
+
+
+# Funzione per recuperare le esecuzioni interrotte
+def get_pending_rollups():
+    """Restituisce {data: [chat_id]} per le chat rimaste in stato 'pending'."""
+    pending = {}
+    with Session() as session:
+        rows = session.query(DailyRollup).filter_by(status="pending").order_by(DailyRollup.run_date)
+        for row in rows:
+            pending.setdefault(row.run_date, []).append(row.chat_id)
+    return pending
+
+
+# Funzione per salvare lo stato di una sessione rimossa dalla memoria
+def save_session_state(chat_id, current_summary, pending_messages):
+    """Salva riassunto corrente e messaggi in attesa; i timestamp vengono convertiti in secondi."""
+    serialized = json.dumps([
+        {**message, 'timestamp': message['timestamp'].timestamp()} for message in pending_messages
+    ])
+    with Session() as session:
+        session.merge(SessionState(chat_id=chat_id, current_summary=current_summary, pending_messages=serialized))
+        session.commit()
+
+
+# Funzione per recuperare lo stato salvato di una sessione
+def get_session_state(chat_id):
+    with Session() as session:
+        state = session.get(SessionState, chat_id)
+        if state is None:
+            return None
+        pending_messages = [
+            {**message, 'timestamp': datetime.fromtimestamp(message['timestamp'])}
+            for message in json.loads(state.pending_messages or "[]")
+        ]
+        return {'current_summary': state.current_summary or "", 'pending_messages': pending_messages}
 
+
+# Funzione per eliminare lo stato salvato di una sessione, una volta ricaricata
+def delete_session_state(chat_id):
+    with Session() as session:
+        session.query(SessionState).filter(SessionState.chat_id == chat_id).delete()
+        session.commit()
+
+
+# Funzione per recuperare gli orari dei riassunti giornalieri delle chat con auto-riassunto
+def get_daily_schedules():
+    """Restituisce {chat_id: (fuso orario, ora locale)} per le chat con auto-riassunto attivo."""
+    with Session() as session:
+        schedules = {}
+        disabled = set()
+        for row in session.query(ChatPreference):
+            if row.auto_summary is False:
+                disabled.add(row.chat_id)
+                continue
+            schedules[row.chat_id] = (
+                row.timezone or Config.DEFAULT_TIMEZONE,
+                Config.DEFAULT_DAILY_HOUR if row.daily_hour is None else row.daily_hour
+            )
+        # Le chat con soli messaggi in sospeso usano le preferenze predefinite
+        for row in session.query(SessionState.chat_id):
+            if row.chat_id not in schedules and row.chat_id not in disabled:
+                schedules[row.chat_id] = (Config.DEFAULT_TIMEZONE, Config.DEFAULT_DAILY_HOUR)
+        return schedules
+
+
+# Funzione per recuperare le chat già registrate per un riassunto giornaliero
+def get_rollup_chat_ids(run_date):
+    with Session() as session:
+        return {row.chat_id for row in session.query(DailyRollup.chat_id).filter_by(run_date=run_date)}
+
+
+# Funzione per registrare un update del webhook prima di confermarlo a Telegram
+def add_pending_update(chat_id, payload, update_id=None):
+    """Salva l'update insieme al suo update_id; restituisce None se l'update_id era già stato ricevuto."""
+    with Session() as session:
+        pending = PendingUpdate(chat_id=chat_id, payload=json.dumps(payload))
+        session.add(pending)
+        if update_id is not None:
+            session.add(SeenUpdate(update_id=update_id))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return None
+        return pending.id
+
+
+# Funzione per rimuovere un update elaborato
+def delete_pending_update(update_row_id):
+    with Session() as session:
+        session.query(PendingUpdate).filter_by(id=update_row_id).delete()
+        session.commit()
+
+
+# Funzione per recuperare, in ordine di arrivo, gli update rimasti da elaborare
+def get_pending_updates():
+    with Session() as session:
+        rows = session.query(PendingUpdate).order_by(PendingUpdate.id)
+        return [(row.id, row.chat_id, json.loads(row.payload)) for row in rows]
+
+
+# Funzione per recuperare gli update_id ricevuti più di recente
+def get_recent_update_ids(limit):
+    with Session() as session:
+        rows = session.query(SeenUpdate.update_id).order_by(SeenUpdate.update_id.desc()).limit(limit)
+        return [row.update_id for row in rows][::-1]
+
+
+# Funzione per limitare la tabella degli update_id ai più recenti
+def prune_seen_updates(keep):
+    with Session() as session:
+        threshold = session.query(SeenUpdate.update_id).order_by(SeenUpdate.update_id.desc()).offset(keep).limit(1).scalar()
+        if threshold is not None:
+            session.query(SeenUpdate).filter(SeenUpdate.update_id <= threshold).delete()
+            session.commit()
@@ -0,0 +1,101 @@
+# deadline_scheduler.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+
+# Configurazione del logger
+logger = logging.getLogger("deadline_scheduler")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+class DeadlineScheduler:
+    """
+    Un unico task che dorme fino alla prossima scadenza tra tutte le chat.
+
+    Le scadenze sono in un heap; reimpostare o annullare la scadenza di una chat costa O(log n)
+    e non crea task: le voci superate restano nell'heap e vengono scartate quando arrivano in cima.
+    """
+
+    def __init__(self):
+        self.heap = []  # (scadenza, sequenza, chiave)
+        self.deadlines = {}  # chiave -> (scadenza, sequenza, callback)
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.task = None
+        self.fired = 0
+
+    def _ensure_started(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            # Contesto vuoto: le callback non ereditano le variabili di contesto (es. la priorità verso
+            # OpenAI) di chi ha impostato la prima scadenza
+            self.task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    def schedule(self, key, delay, callback):
+        """Imposta (o sposta) la scadenza di 'key' fra 'delay' secondi; callback è una coroutine function."""
+        self._ensure_started()
+        deadline = time.monotonic() + delay
+        sequence = next(self.sequence)
+        self.deadlines[key] = (deadline, sequence, callback)
+        heapq.heappush(self.heap, (deadline, sequence, key))
+        self._compact()
+        # Il task va svegliato solo se la nuova scadenza è la più vicina
+        if self.heap[0][1] == sequence:
+            self.wakeup.set()
+
+    def cancel(self, key):
+        return self.deadlines.pop(key, None) is not None
+
+    def is_scheduled(self, key):
+        return key in self.deadlines
+
+    def _is_current(self, entry):
+        _, sequence, key = entry
+        current = self.deadlines.get(key)
+        return current is not None and current[1] == sequence
+
+    def _compact(self):
+        # Ricostruisce l'heap quando le voci superate sono la maggioranza
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(deadline, sequence, key) for key, (deadline, sequence, _) in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    async def _run(self):
+        while True:
+            while self.heap and not self._is_current(self.heap[0]):
+                heapq.heappop(self.heap)
+            if not self.heap:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+
+            _, _, key = heapq.heappop(self.heap)
+            _, _, callback = self.deadlines.pop(key)
+            self.fired += 1
+            asyncio.create_task(self._fire(key, callback))
+
+    async def _fire(self, key, callback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"Errore nella scadenza di '{key}': {e}")
+
+    def stats(self):
+        return {"scheduled": len(self.deadlines), "heap_size": len(self.heap), "fired": self.fired}
+
+
+deadline_scheduler = DeadlineScheduler()
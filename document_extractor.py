@@ -0,0 +1,231 @@
+# document_extractor.py
+
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+from collections import OrderedDict
+
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("document_extractor")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+TRUNCATED_MARKER = "[... documento troncato ...]"
+
+
+class DocumentTooLargeError(Exception):
+    """Il documento supera DOCUMENT_MAX_BYTES."""
+
+
+class DocumentTimeoutError(Exception):
+    """L'estrazione del documento ha superato DOCUMENT_TIMEOUT."""
+
+
+class DocumentExtractionError(Exception):
+    """Il processo di estrazione ha sollevato un'eccezione o è terminato senza risultato."""
+
+
+def _extract(data, name, token_budget):
+    # Eseguita nel processo dell'estrazione: unstructured viene importato solo lì
+    from unstructured.partition.auto import partition
+    from tokenizer import count_tokens
+
+    elements = partition(file=io.BytesIO(data), metadata_filename=name)
+    pages, used, page, lines = [], 0, None, []
+    for element in elements:
+        if not element.text:
+            continue
+        element_page = getattr(element.metadata, "page_number", None)
+        if element_page != page and lines:
+            pages.append("\n".join(lines))
+            lines = []
+        page = element_page
+        tokens = count_tokens(element.text)
+        # Gli elementi vengono aggiunti pagina per pagina finché c'è budget
+        if used + tokens > token_budget:
+            lines.append(TRUNCATED_MARKER)
+            break
+        lines.append(element.text)
+        used += tokens
+    if lines:
+        pages.append("\n".join(lines))
+    return "\n\n".join(pages)
+
+
+# Secondi concessi a un processo di estrazione per avviarsi e caricare unstructured
+WORKER_START_TIMEOUT = 120
+
+
+def _worker_main(connection):
+    # Processo di estrazione a lunga vita: unstructured viene caricato una volta, prima del primo documento
+    try:
+        import unstructured.partition.auto  # noqa: F401
+    except ImportError as e:
+        logger.warning(f"unstructured non disponibile: {e}")
+    connection.send("ready")
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        data, name, token_budget = request
+        try:
+            connection.send((True, _extract(data, name, token_budget)))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _ExtractionWorker:
+    """Processo di estrazione riusato tra i documenti; i metodi bloccanti vengono eseguiti in un thread."""
+
+    def __init__(self, context):
+        self.connection, self.child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(self.child,), name="document-extractor", daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.child.close()
+        try:
+            if self.connection.poll(WORKER_START_TIMEOUT) and self.connection.recv() == "ready":
+                return
+        except (EOFError, OSError):
+            pass
+        raise DocumentExtractionError("Il processo di estrazione non si è avviato.")
+
+    def extract(self, data, name, token_budget):
+        # Se il processo viene ucciso durante l'attesa, recv termina con EOFError
+        self.connection.send((data, name, token_budget))
+        return self.connection.recv()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class DocumentExtractor:
+    """
+    Estrazione del testo dei documenti in un insieme limitato di processi a lunga vita.
+
+    Ogni processo carica unstructured una sola volta ed estrae un documento alla volta. Ogni documento
+    ha limiti di dimensione e di tempo: allo scadere del timeout (o se la richiesta viene annullata)
+    viene ucciso e sostituito solo il processo bloccato, senza toccare le altre estrazioni. I risultati
+    restano in una LRU indicizzata per hash del contenuto.
+    """
+
+    def __init__(self, workers=None, timeout=None, max_bytes=None, token_budget=None, cache_size=None):
+        self.workers = workers or Config.DOCUMENT_WORKERS
+        self.timeout = timeout or Config.DOCUMENT_TIMEOUT
+        self.max_bytes = max_bytes or Config.DOCUMENT_MAX_BYTES
+        self.token_budget = token_budget or Config.DOCUMENT_TOKEN_BUDGET
+        self.cache_size = Config.DOCUMENT_CACHE_SIZE if cache_size is None else cache_size
+        self.cache = OrderedDict()
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = None  # Processi liberi; None indica un posto il cui processo va (ri)avviato
+        self.processes = set()
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.restarts = 0
+
+    def _ensure_started(self):
+        if self.idle is None:
+            # Gli altri documenti aspettano qui che un processo si liberi
+            self.idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self.idle.put_nowait(None)
+
+    async def _checkout(self):
+        worker = await self.idle.get()
+        if worker is not None and worker.process.is_alive():
+            return worker
+        if worker is not None:
+            self._discard(worker)
+        worker = _ExtractionWorker(self.context)
+        self.processes.add(worker)
+        # L'avvio attende il caricamento di unstructured: fuori dal loop e fuori dal timeout del documento
+        starting = asyncio.ensure_future(asyncio.to_thread(worker.start))
+        try:
+            await asyncio.shield(starting)
+        except asyncio.CancelledError:
+            starting.add_done_callback(lambda _: self._discard(worker))
+            self.idle.put_nowait(None)
+            raise
+        except Exception:
+            self._discard(worker)
+            self.idle.put_nowait(None)
+            raise
+        return worker
+
+    def _discard(self, worker):
+        self.processes.discard(worker)
+        worker.kill()
+        if worker.process.pid is not None:
+            asyncio.get_running_loop().run_in_executor(None, worker.process.join)
+
+    async def _run(self, data, name):
+        worker = await self._checkout()
+        healthy = False
+        try:
+            ok, result = await asyncio.wait_for(asyncio.to_thread(worker.extract, data, name, self.token_budget), self.timeout)
+            healthy = True
+        except (EOFError, ConnectionError):
+            raise DocumentExtractionError(f"Il processo di estrazione di '{name}' è terminato senza risultato.")
+        finally:
+            if healthy:
+                self.idle.put_nowait(worker)
+            else:
+                # Scaduto, annullato o terminato: viene sostituito solo questo processo
+                self.restarts += 1
+                self._discard(worker)
+                self.idle.put_nowait(None)
+        if not ok:
+            raise DocumentExtractionError(result)
+        return result
+
+    async def extract(self, data, name):
+        if len(data) > self.max_bytes:
+            raise DocumentTooLargeError(f"Il documento '{name}' supera il limite di {self.max_bytes} byte.")
+
+        # Fino a DOCUMENT_MAX_BYTES di hash: in un thread, fuori dal loop
+        key = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+
+        self._ensure_started()
+        try:
+            text = await self._run(data, name)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise DocumentTimeoutError(f"Estrazione di '{name}' interrotta dopo {self.timeout}s.")
+        except DocumentExtractionError:
+            self.failures += 1
+            raise
+
+        if self.cache_size:
+            self.cache[key] = text
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return text
+
+    def stats(self):
+        return {"cached": len(self.cache), "processes": len(self.processes), "hits": self.hits, "misses": self.misses,
+                "timeouts": self.timeouts, "failures": self.failures, "restarts": self.restarts}
+
+    def close(self):
+        for worker in list(self.processes):
+            worker.kill()
+        self.processes.clear()
+        self.idle = None
+
+
+document_extractor = DocumentExtractor()
@@ -0,0 +1,146 @@
+# evaluation_worker.py
+
+import asyncio
+import logging
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from config import Config
+from async_database import add_evaluation
+
+# Configurazione del logger
+logger = logging.getLogger("evaluation")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Istanza di SummaryEvaluator residente in ciascun processo del pool
+_evaluator = None
+
+
+def _get_evaluator():
+    global _evaluator
+    if _evaluator is None:
+        from test_project import SummaryEvaluator
+        _evaluator = SummaryEvaluator()
+    return _evaluator
+
+
+def _evaluate_batch(pairs):
+    # Eseguita nei processi del pool: calcola ROUGE, BERTScore e similarità delle parole chiave
+    return _get_evaluator().compute_all_batch(pairs)
+
+
+def _warm_up():
+    # Carica i modelli spaCy e BERTScore nel processo del pool con una valutazione fittizia
+    _get_evaluator().compute_all_batch([("Ciao a tutti.", "Ciao a tutti, come state?")])
+
+
+class EvaluationWorker:
+    """Coda fire-and-forget che valuta i riassunti in un pool di processi e salva i punteggi."""
+
+    def __init__(self, sample_rate=None, max_backlog=None, workers=None, max_batch_size=None, max_wait=None):
+        self.sample_rate = Config.EVAL_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.max_backlog = Config.EVAL_MAX_BACKLOG if max_backlog is None else max_backlog
+        self.workers = Config.EVAL_WORKERS if workers is None else workers
+        self.max_batch_size = Config.BERT_MAX_BATCH_SIZE if max_batch_size is None else max_batch_size
+        self.max_wait = Config.BERT_MAX_WAIT if max_wait is None else max_wait
+
+        self.queue = None
+        self.executor = None
+        self.tasks = []
+        self.remote = None  # Nei worker di shard_router le valutazioni vanno al pool del processo principale
+        self.dropped = 0
+        self.completed = 0
+
+    def _ensure_started(self):
+        # Avvio pigro: la coda e i consumer vengono creati nel loop in esecuzione
+        if self.queue is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_backlog)
+        # spawn: il processo ha già thread attivi (database, to_thread, shard_router), fork rischierebbe deadlock
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    def submit(self, generated_summary, original_text, chat_id=None):
+        """Accoda una valutazione senza attenderla; restituisce False se scartata."""
+        if not generated_summary or not original_text:
+            return False
+        if random.random() >= self.sample_rate:
+            return False
+        if self.remote is not None:
+            self.remote.evaluate(generated_summary, original_text, chat_id)
+            return True
+        return self.enqueue(generated_summary, original_text, chat_id)
+
+    def enqueue(self, generated_summary, original_text, chat_id=None):
+        """Accoda una valutazione già campionata; restituisce False se la coda è piena."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((chat_id, generated_summary, original_text))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Coda di valutazione piena, valutazione scartata (totale scartate: {self.dropped}).")
+            return False
+
+    async def _next_batch(self):
+        # Attende il primo elemento, poi raccoglie gli altri in arrivo entro max_wait
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                pairs = [(generated_summary, original_text) for _, generated_summary, original_text in batch]
+                results = await loop.run_in_executor(self.executor, _evaluate_batch, pairs)
+                for (chat_id, _, _), result in zip(batch, results):
+                    await add_evaluation(chat_id, result)
+                    logger.debug(f"Valutazione salvata per la chat {chat_id}: {result}")
+                self.completed += len(batch)
+            except Exception as e:
+                logger.error(f"Errore durante la valutazione dei riassunti: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def warm_up(self):
+        """Carica i modelli in ogni processo del pool prima della prima valutazione reale."""
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*[loop.run_in_executor(self.executor, _warm_up) for _ in range(self.workers)])
+        except Exception as e:
+            logger.warning(f"Warm-up della valutazione non riuscito: {e}")
+
+    def stats(self):
+        return {
+            "backlog": self.queue.qsize() if self.queue else 0,
+            "completed": self.completed,
+            "dropped": self.dropped,
+        }
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.queue = None
+
+
+evaluation_worker = EvaluationWorker()
@@ -0,0 +1,129 @@
+# frame_sampler.py
+
+import base64
+import logging
+import math
+
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("frame_sampler")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+def frame_hash(frame):
+    """Difference hash a 64 bit: economico e robusto a piccole variazioni di luce e compressione."""
+    import cv2
+    import numpy as np
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = np.packbits((small[:, 1:] > small[:, :-1]).flatten())
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def hash_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def downscale(frame, max_side):
+    import cv2
+
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def encode_frame(frame, quality=85):
+    import cv2
+
+    _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def target_timestamps(duration, max_frames=None, frame_interval=None):
+    """Istanti (in secondi) da campionare: uno ogni frame_interval, entro il budget di fotogrammi."""
+    max_frames = max_frames or Config.VIDEO_MAX_FRAMES
+    frame_interval = frame_interval or Config.VIDEO_FRAME_INTERVAL
+    count = max(1, min(max_frames, math.ceil(duration / frame_interval)))
+    # Centro di ciascun intervallo, per evitare il primo fotogramma spesso nero
+    return [(i + 0.5) * duration / count for i in range(count)]
+
+
+class FrameDeduplicator:
+    """Scarta i fotogrammi quasi identici all'ultimo fotogramma mantenuto."""
+
+    def __init__(self, min_distance=None):
+        self.min_distance = Config.VIDEO_MIN_HASH_DISTANCE if min_distance is None else min_distance
+        self.last_hash = None
+
+    def is_duplicate(self, frame):
+        current_hash = frame_hash(frame)
+        if self.last_hash is not None and hash_distance(current_hash, self.last_hash) < self.min_distance:
+            return True
+        self.last_hash = current_hash
+        return False
+
+
+def sample_frames(video_path, max_frames=None, max_side=None, frame_interval=None, min_distance=None):
+    """
+    Campiona i fotogrammi di un video posizionandosi direttamente sugli istanti scelti.
+
+    Solo i fotogrammi mantenuti vengono ridimensionati e codificati in JPEG/base64,
+    quindi il costo è limitato dal budget e non dalla lunghezza del video.
+    """
+    import cv2
+
+    max_side = max_side or Config.VIDEO_FRAME_MAX_SIDE
+    deduplicator = FrameDeduplicator(min_distance)
+    frames = []
+
+    video = cv2.VideoCapture(video_path)
+    try:
+        if not video.isOpened():
+            raise ValueError(f"Impossibile aprire il video '{video_path}'.")
+
+        fps = video.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if fps <= 0 or frame_count <= 0:
+            # Metadati assenti: si legge solo il primo fotogramma utile
+            success, frame = video.read()
+            return [encode_frame(downscale(frame, max_side))] if success else []
+
+        duration = frame_count / fps
+        for timestamp in target_timestamps(duration, max_frames, frame_interval):
+            video.set(cv2.CAP_PROP_POS_FRAMES, min(int(timestamp * fps), frame_count - 1))
+            success, frame = video.read()
+            if not success:
+                continue
+            frame = downscale(frame, max_side)
+            if deduplicator.is_duplicate(frame):
+                continue
+            frames.append(encode_frame(frame))
+    finally:
+        video.release()
+
+    logger.debug(f"Campionati {len(frames)} fotogrammi da '{video_path}'.")
+    return frames
+
+
+def load_frames(frame_paths, min_distance=None):
+    """
+    Carica i fotogrammi JPEG già estratti e ridimensionati (es. da ffmpeg), scartando i duplicati.
+
+    I file mantenuti vengono codificati in base64 così come sono, senza ricompressione.
+    """
+    import cv2
+
+    deduplicator = FrameDeduplicator(min_distance)
+    frames = []
+    for path in frame_paths:
+        frame = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if frame is None or deduplicator.is_duplicate(frame):
+            continue
+        with open(path, "rb") as f:
+            frames.append(base64.b64encode(f.read()).decode("utf-8"))
+    return frames
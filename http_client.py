@@ -0,0 +1,50 @@
+# http_client.py
+
+import importlib.util
+import logging
+
+import httpx
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("http_client")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Client HTTP condiviso da tutta l'applicazione
+_client = None
+
+
+def _create_client():
+    # HTTP/2 solo se il pacchetto 'h2' è installato
+    http2 = importlib.util.find_spec("h2") is not None
+    limits = httpx.Limits(
+        max_connections=Config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(Config.HTTP_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT)
+    logger.info(f"Client HTTP condiviso creato (HTTP/2: {'attivo' if http2 else 'non disponibile'}).")
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+async def start_http_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+def get_http_client():
+    """Restituisce il client condiviso, creandolo se l'applicazione non l'ha ancora avviato."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -27,6 +27,10 @@ LANGUAGES = {
         'set_filter_placeholder': "Imposta Filtro",
         'error_invalid_format': "Errore formato non valido, Riprova.",
         'error_invalid_summary_length_format': "Errore: seleziona una lunghezza valida per il riassunto.",
+        'daily_schedule': "Orario",
+        'daily_schedule_help': "Il riassunto giornaliero arriva alle {hour} ({timezone}).\nUsa /ora_riassunto <0-23> per cambiare l'ora e /fuso_orario <Area/Città> (es. Europe/Rome) per cambiare il fuso orario.",
+        'error_invalid_hour': "Errore: indica un'ora tra 0 e 23, ad esempio /ora_riassunto 20.",
+        'error_invalid_timezone': "Errore: fuso orario non riconosciuto, ad esempio /fuso_orario Europe/Rome.",
     },
     'en': {
         'main_menu_text': "Welcome! Choose an option from the menu:",
@@ -54,6 +58,10 @@ LANGUAGES = {
         'set_filter_placeholder': "Set Filter",
         'error_invalid_format': "Invalid format error, please try again.",
         'error_invalid_summary_length_format': "Error: please select a valid summary length.",
+        'daily_schedule': "Schedule",
+        'daily_schedule_help': "The daily summary is sent at {hour} ({timezone}).\nUse /ora_riassunto <0-23> to change the hour and /fuso_orario <Area/City> (e.g. Europe/London) to change the time zone.",
+        'error_invalid_hour': "Error: enter an hour between 0 and 23, for example /ora_riassunto 20.",
+        'error_invalid_timezone': "Error: unknown time zone, for example /fuso_orario Europe/London.",
     },
     'fr': {
         'main_menu_text': "Bienvenue! Choisissez une option dans le menu:",
@@ -81,5 +89,9 @@ LANGUAGES = {
         'set_filter_placeholder': "Définir le filtre",
         'error_invalid_format': "Erreur de format invalide, veuillez réessayer.",
         'error_invalid_summary_length_format': "Erreur : veuillez sélectionner une longueur de résumé valide.",
+        'daily_schedule': "Horaire",
+        'daily_schedule_help': "Le résumé quotidien est envoyé à {hour} h ({timezone}).\nUtilisez /ora_riassunto <0-23> pour changer l'heure et /fuso_orario <Zone/Ville> (ex. Europe/Paris) pour changer le fuseau horaire.",
+        'error_invalid_hour': "Erreur : indiquez une heure entre 0 et 23, par exemple /ora_riassunto 20.",
+        'error_invalid_timezone': "Erreur : fuseau horaire inconnu, par exemple /fuso_orario Europe/Paris.",
     },
 }
@@ -0,0 +1,128 @@
+# media_cache.py
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from config import Config
+from async_database import get_media_analysis, save_media_analysis
+
+# Configurazione del logger
+logger = logging.getLogger("media_cache")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Parti del messaggio che entrano nel prompt dell'analisi (vedi NLPService.analyze_*): solo queste
+# fanno parte della chiave. Audio e documenti dipendono solo dal file, così sticker e file ricorrenti
+# vengono analizzati una volta sola per tutti gli utenti
+CAPTION_TYPES = frozenset({"photo", "sticker", "video", "animation", "video_note"})
+SENDER_TYPES = frozenset({"video", "animation", "video_note"})
+
+
+def _context_suffix(message):
+    media_type = message['type']
+    parts = []
+    if media_type in CAPTION_TYPES:
+        parts.append(message.get('caption') or '')
+    if media_type in SENDER_TYPES:
+        parts.append(message.get('username') or '')
+    if not parts:
+        return ""
+    return ":" + hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class MediaCache:
+    """Cache dei risultati di analisi dei media: LRU in memoria davanti alla tabella SQLite."""
+
+    def __init__(self, max_size=None):
+        self.max_size = Config.MEDIA_CACHE_SIZE if max_size is None else max_size
+        self.entries = OrderedDict()
+        self.inflight = {}  # chiave -> task dell'analisi in corso, condiviso tra le richieste
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def cache_key(self, message):
+        # Chiave per contenuto: file_unique_id di Telegram, altrimenti hash del file locale
+        media_type = message['type']
+        suffix = _context_suffix(message)
+        file_unique_id = message.get('file_unique_id')
+        if file_unique_id:
+            return f"tg:{media_type}:{file_unique_id}{suffix}"
+        content = message['content']
+        if not content.startswith(("http://", "https://")) and os.path.exists(content):
+            return f"sha256:{media_type}:{await asyncio.to_thread(_file_sha256, content)}{suffix}"
+        return None
+
+    def _remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        result = await get_media_analysis(key)
+        if result is not None:
+            self._remember(key, result)
+        return result
+
+    async def put(self, key, media_type, result):
+        self._remember(key, result)
+        await save_media_analysis(key, media_type, result)
+
+    async def get_or_analyze(self, message, analysis_func):
+        """Restituisce l'analisi in cache del media, altrimenti la calcola e la memorizza."""
+        key = await self.cache_key(message)
+        if key is None:
+            return await analysis_func(message)
+
+        task = self.inflight.get(key)
+        if task is None:
+            cached = await self.get(key)
+            if cached is not None:
+                self.hits += 1
+                logger.debug(f"Analisi del media '{key}' trovata in cache.")
+                return cached
+            # Un'altra richiesta può aver avviato l'analisi durante la lettura dal database
+            task = self.inflight.get(key)
+
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._analyze(key, message, analysis_func))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: l'annullamento di una richiesta non interrompe l'analisi condivisa con le altre
+        return await asyncio.shield(task)
+
+    async def _analyze(self, key, message, analysis_func):
+        result = await analysis_func(message)
+        # Le analisi fallite restituiscono una stringa vuota e non vengono memorizzate
+        if result:
+            try:
+                await self.put(key, message['type'], result)
+            except Exception as e:
+                logger.error(f"Errore durante il salvataggio in cache del media '{key}': {e}")
+        return result
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "coalesced": self.coalesced, "inflight": len(self.inflight)}
+
+
+media_cache = MediaCache()
@@ -0,0 +1,129 @@
+# media_demux.py
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import shutil
+
+from config import Config
+from frame_sampler import load_frames, sample_frames, target_timestamps
+
+# Configurazione del logger
+logger = logging.getLogger("media_demux")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+class DemuxError(Exception):
+    """ffmpeg non è riuscito a separare audio e fotogrammi del video."""
+
+
+def ffmpeg_available():
+    return shutil.which(Config.FFMPEG_BINARY) is not None and shutil.which(Config.FFPROBE_BINARY) is not None
+
+
+def demux_video(video_path, audio_path, frames_dir):
+    """
+    Separa la traccia audio (mono, a basso bitrate, adatta al parlato) e i fotogrammi campionati.
+
+    Restituisce due task: il primo indica se l'audio è stato scritto in audio_path, il secondo
+    restituisce i fotogrammi in base64; ciascuna analisi può partire appena il proprio input è pronto.
+    Con ffmpeg il video viene decodificato una sola volta in un sottoprocesso; altrimenti moviepy e
+    OpenCV lavorano in parallelo in thread separati.
+    """
+    if ffmpeg_available():
+        demux = asyncio.create_task(_ffmpeg_demux(video_path, audio_path, frames_dir))
+        audio_task = asyncio.create_task(_audio_from(demux))
+        frames_task = asyncio.create_task(_frames_from(demux))
+    else:
+        audio_task = asyncio.create_task(asyncio.to_thread(extract_audio_track, video_path, audio_path))
+        frames_task = asyncio.create_task(asyncio.to_thread(sample_frames, video_path))
+    return audio_task, frames_task
+
+
+async def _audio_from(demux):
+    has_audio, _ = await demux
+    return has_audio
+
+
+async def _frames_from(demux):
+    _, frame_paths = await demux
+    return await asyncio.to_thread(load_frames, frame_paths)
+
+
+async def _run(*args, timeout=None):
+    timeout = timeout or Config.VIDEO_DEMUX_TIMEOUT
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise DemuxError(f"{os.path.basename(args[0])} interrotto dopo {timeout}s.") from None
+    finally:
+        # Scaduto o annullato (es. analisi abbandonata): il sottoprocesso non deve restare in esecuzione
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        message = stderr.decode(errors="replace").strip()
+        raise DemuxError(message.splitlines()[-1] if message else f"codice di uscita {process.returncode}")
+    return stdout
+
+
+async def probe(video_path):
+    """Durata e presenza di audio e video, lette dall'intestazione del file."""
+    output = await _run(
+        Config.FFPROBE_BINARY, "-v", "error", "-show_entries", "format=duration:stream=codec_type",
+        "-of", "json", video_path)
+    info = json.loads(output or b"{}")
+    stream_types = {stream.get("codec_type") for stream in info.get("streams", [])}
+    duration = float(info.get("format", {}).get("duration") or 0)
+    return duration, "audio" in stream_types, "video" in stream_types
+
+
+async def _ffmpeg_demux(video_path, audio_path, frames_dir):
+    duration, has_audio, has_video = await probe(video_path)
+    command = [Config.FFMPEG_BINARY, "-v", "error", "-y", "-i", video_path]
+
+    if has_audio:
+        command += ["-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(Config.VIDEO_AUDIO_SAMPLE_RATE),
+                    "-b:a", Config.VIDEO_AUDIO_BITRATE, audio_path]
+
+    frame_pattern = os.path.join(frames_dir, "frame_%03d.jpg")
+    if has_video:
+        count = len(target_timestamps(duration)) if duration > 0 else 1
+        side = Config.VIDEO_FRAME_MAX_SIDE
+        # Campionamento uniforme e ridimensionamento nello stesso passaggio di decodifica. Il campionamento
+        # parte da mezzo intervallo, così i fotogrammi cadono al centro di ogni intervallo come in
+        # target_timestamps invece che su t=0, spesso nero
+        sampling = ""
+        if duration > 0:
+            interval = duration / count
+            sampling = f"trim=start={interval / 2:.6f},setpts=PTS-STARTPTS,fps={1 / interval:.6f},"
+        video_filter = sampling + (
+            f"scale=w='min(iw,{side})':h='min(ih,{side})':force_original_aspect_ratio=decrease")
+        command += ["-map", "0:v:0", "-an", "-vf", video_filter, "-frames:v", str(count), "-q:v", "3",
+                    frame_pattern]
+
+    if has_audio or has_video:
+        await _run(*command)
+    return has_audio, sorted(glob.glob(os.path.join(frames_dir, "frame_*.jpg")))
+
+
+def extract_audio_track(video_file_name, audio_file_name):
+    """Estrazione con moviepy, usata quando ffmpeg non è nel PATH."""
+    # Dipendenza pesante caricata solo al primo video
+    from moviepy.editor import VideoFileClip
+
+    video_clip = VideoFileClip(video_file_name)
+    try:
+        has_audio = video_clip.audio is not None
+        if has_audio:
+            video_clip.audio.write_audiofile(
+                audio_file_name, fps=Config.VIDEO_AUDIO_SAMPLE_RATE, bitrate=Config.VIDEO_AUDIO_BITRATE,
+                ffmpeg_params=["-ac", "1"], logger=None)
+        return has_audio
+    finally:
+        video_clip.close()
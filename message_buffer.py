@@ -0,0 +1,129 @@
+# message_buffer.py
+
+import sys
+from datetime import datetime
+
+
+class MessageRecord:
+    """
+    Messaggio in memoria con __slots__: username condivisi tramite sys.intern e timestamp in secondi interi.
+
+    Supporta l'accesso come dizionario (message['timestamp'], message.get(...), {**message}) usato da
+    nlp, media_cache e database; 'timestamp' viene restituito come datetime.
+    """
+
+    __slots__ = ('username', 'type', 'content', 'ts', 'caption', 'file_unique_id')
+
+    KEYS = ('username', 'type', 'content', 'timestamp', 'caption', 'file_unique_id')
+
+    def __init__(self, username, message_type, content, timestamp, caption=None, file_unique_id=None):
+        self.username = sys.intern(username) if username else username
+        self.type = sys.intern(message_type)
+        self.content = content
+        self.ts = int(timestamp.timestamp() if isinstance(timestamp, datetime) else timestamp)
+        self.caption = caption or None
+        self.file_unique_id = file_unique_id
+
+    @classmethod
+    def from_dict(cls, message):
+        return cls(message['username'], message['type'], message['content'], message['timestamp'],
+                   message.get('caption'), message.get('file_unique_id'))
+
+    def __getitem__(self, key):
+        if key == 'timestamp':
+            return datetime.fromtimestamp(self.ts)
+        if key == 'caption':
+            return self.caption or ""
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.KEYS
+
+
+class BufferView:
+    """Vista in sola lettura su una porzione del buffer, senza copiarne i record."""
+
+    __slots__ = ('records', 'start', 'stop')
+
+    def __init__(self, records, start, stop):
+        self.records = records
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        for index in range(self.start, self.stop):
+            yield self.records[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.records[i] for i in range(self.start, self.stop)[index]]
+        return self.records[range(self.start, self.stop)[index]]
+
+    def __bool__(self):
+        return self.stop > self.start
+
+
+class MessageBuffer:
+    """
+    Unico buffer dei messaggi di una chat.
+
+    I record da 'persisted' in poi non sono ancora nel database (messaggi giornalieri); quelli da
+    'window_start' in poi non sono ancora stati riassunti. Entrambe le porzioni sono viste sulla
+    stessa lista; i record già salvati e riassunti vengono scartati.
+    """
+
+    __slots__ = ('records', 'persisted', 'window_start')
+
+    def __init__(self):
+        self.records = []
+        self.persisted = 0
+        self.window_start = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def window(self):
+        """Messaggi ancora da riassumere."""
+        return BufferView(self.records, self.window_start, len(self.records))
+
+    def unsaved(self):
+        """Messaggi del giorno non ancora salvati nel database."""
+        return BufferView(self.records, self.persisted, len(self.records))
+
+    def close_window(self, count):
+        """I primi 'count' messaggi della finestra sono stati riassunti."""
+        self.window_start = min(self.window_start + count, len(self.records))
+        self._compact()
+
+    def mark_persisted(self, count):
+        """I primi 'count' messaggi non salvati sono stati scritti nel database."""
+        self.persisted += count
+        self._compact()
+
+    def restore_window(self, records):
+        """Ripristina messaggi in attesa di riassunto già salvati nel database (sessione ricaricata)."""
+        self.records = list(records) + self.records[self.persisted:]
+        self.window_start = 0
+        self.persisted = len(records)
+
+    def _compact(self):
+        # Nuova lista invece di del: le viste già restituite restano valide durante le analisi in corso
+        done = min(self.persisted, self.window_start)
+        if done:
+            self.records = self.records[done:]
+            self.persisted -= done
+            self.window_start -= done
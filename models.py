@@ -1,8 +1,17 @@
 #models.py
 
+import json
+
 from pydantic import BaseModel, Field
 from typing import Optional, List
 
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale: senza, si usa il modulo json standard
+    orjson = None
+
 class Chat(BaseModel):
     id: Optional[int] = None
 
@@ -13,6 +22,7 @@ class User(BaseModel):
 
 class Media(BaseModel):
     file_id: str
+    file_unique_id: Optional[str] = None
     mime_type: Optional[str] = None
     file_size: Optional[int] = None
     is_animated: Optional[bool] = None
@@ -36,3 +46,95 @@ class Message(BaseModel):
 class Update(BaseModel):
     update_id: int
     message: Optional[Message] = None
+
+
+# Decodifica veloce degli update del webhook: record con __slots__ che leggono solo i campi
+# usati da process_message; i media vengono convertiti solo quando richiesti.
+
+MEDIA_FIELDS = ('photo', 'video', 'document', 'audio', 'voice', 'animation', 'sticker', 'video_note')
+
+
+class FastChat:
+    __slots__ = ('id',)
+
+    def __init__(self, data):
+        self.id = data.get('id')
+
+
+class FastUser:
+    __slots__ = ('username', 'first_name', 'last_name')
+
+    def __init__(self, data):
+        self.username = data.get('username')
+        self.first_name = data.get('first_name')
+        self.last_name = data.get('last_name')
+
+
+class FastMedia:
+    __slots__ = ('file_id', 'file_unique_id', 'mime_type', 'file_size', 'is_animated', 'is_video')
+
+    def __init__(self, data):
+        self.file_id = data['file_id']
+        self.file_unique_id = data.get('file_unique_id')
+        self.mime_type = data.get('mime_type')
+        self.file_size = data.get('file_size')
+        self.is_animated = data.get('is_animated')
+        self.is_video = data.get('is_video')
+
+
+class FastMessage:
+    __slots__ = ('chat', 'from_user', 'text', 'date', 'caption', '_raw', '_media')
+
+    def __init__(self, data):
+        chat = data.get('chat')
+        user = data.get('from')
+        self.chat = FastChat(chat) if chat is not None else None
+        self.from_user = FastUser(user) if user is not None else None
+        self.text = data.get('text')
+        self.date = data.get('date')
+        self.caption = data.get('caption')
+        self._raw = data
+        self._media = None
+
+    def __getattr__(self, name):
+        # Chiamato solo per gli attributi assenti dagli slot, cioè per i campi media
+        if name not in MEDIA_FIELDS:
+            raise AttributeError(name)
+        if self._media is None:
+            self._media = {}
+        if name not in self._media:
+            value = self._raw.get(name)
+            if value is not None:
+                value = [FastMedia(item) for item in value] if name == 'photo' else FastMedia(value)
+            self._media[name] = value
+        return self._media[name]
+
+
+class FastUpdate:
+    __slots__ = ('update_id', 'message')
+
+    def __init__(self, data):
+        update_id = data['update_id']
+        if not isinstance(update_id, int):
+            raise ValueError("update_id deve essere un intero")
+        message = data.get('message')
+        self.update_id = update_id
+        self.message = FastMessage(message) if message is not None else None
+
+
+def loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+def parse_update(data, strict=None):
+    """Costruisce l'update da un dict già decodificato; con strict usa la validazione completa di pydantic."""
+    strict = Config.STRICT_UPDATE_VALIDATION if strict is None else strict
+    return Update(**data) if strict else FastUpdate(data)
+
+
+def decode_update(body, strict=None):
+    """Decodifica il corpo JSON di un webhook; restituisce (update, dict)."""
+    data = loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("L'update deve essere un oggetto JSON")
+    return parse_update(data, strict), data
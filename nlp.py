@@ -1,19 +1,24 @@
 #nlp.py
 
 import asyncio
-import base64
+import io
 import logging
 import os
+import random
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import urlparse
 
-import cv2
-import httpx
-import openai
 from config import Config
-from moviepy.editor import VideoFileClip
-from test_project import SummaryEvaluator, eval
-from unstructured.partition.auto import partition
-
-import shutil
+from document_extractor import document_extractor
+from evaluation_worker import evaluation_worker
+from http_client import get_http_client
+from media_cache import media_cache
+from media_demux import demux_video
+from openai_scheduler import scheduler
+from prompt_builder import compact_transcript, input_budget
+from test_project import eval
+from tokenizer import count_tokens, split_by_tokens
 
 
 # Configura il logger
@@ -24,6 +29,27 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+
+class MediaTooLargeError(ValueError):
+    pass
+
+
+def is_url(source):
+    return source.startswith("http://") or source.startswith("https://")
+
+
+@contextmanager
+def temp_media_path(suffix):
+    # File temporaneo univoco per ogni analisi, rimosso al termine
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=Config.MEDIA_TEMP_DIR)
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 # Decoratore per il backoff
 def backoff_decorator(retries=5, base_delay=1, max_delay=16):
     def decorator(func):
@@ -43,28 +69,77 @@ def backoff_decorator(retries=5, base_delay=1, max_delay=16):
     return decorator
 
 class NLP:
+    """
+    Servizio NLP condiviso da tutte le chat.
+
+    Non conserva stato per chat: la trascrizione viene costruita a partire dai messaggi ricevuti
+    e passata esplicitamente. Il client OpenAI e il suo pool di connessioni sono unici per processo
+    e tutte le richieste passano dallo scheduler globale, che applica priorità e limiti di frequenza.
+    """
+
     def __init__(self):
-        self.client = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY)
-        self.summary = ""
-        self.fidality = SummaryEvaluator(Config.OPENAI_API_KEY)
+        import httpx
+        import openai
+        self.client = openai.AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            # I tentativi dopo un 429 sono coordinati dallo scheduler
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.OPENAI_MAX_CONNECTIONS,
+                )
+            ),
+        )
 
-    async def process_messages(self, messages, context, preferences):
+    def estimate_tokens(self, messages, max_tokens=0):
+        """Stima locale dei token di una richiesta chat: testo in input, immagini e output massimo."""
+        total = max_tokens or 0
+        for message in messages:
+            content = message["content"]
+            parts = content if isinstance(content, list) else [content]
+            for part in parts:
+                if isinstance(part, str):
+                    total += count_tokens(part)
+                elif part.get("type") == "text":
+                    total += count_tokens(part["text"])
+                else:
+                    total += Config.OPENAI_IMAGE_TOKENS
+        return total
+
+    async def chat_completion(self, **kwargs):
+        estimated_tokens = self.estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+        return await scheduler.run(lambda: self.client.chat.completions.create(**kwargs), estimated_tokens)
+
+    async def transcribe(self, **kwargs):
+        # Whisper non consuma il budget di token delle chat, ma conta come richiesta
+        return await scheduler.run(lambda: self.client.audio.transcriptions.create(**kwargs))
+
+    async def process_messages(self, messages, context, preferences, chat_id=None):
         eval.start("Analyzer")
         print("questo è il contesto: ",context)
+        transcript = await self.build_transcript(messages)
+        eval.stop("Analyzer")
+        return await self.generate_summary(transcript, context, preferences, chat_id)
+
+    async def build_transcript(self, messages):
+        """Trasforma i messaggi in righe di trascrizione, analizzando i media in parallelo e mantenendo l'ordine."""
         tasks = []
         for message in messages:
-            if message['type'] == 'text': self.summary += f"[{message['timestamp']}] {message['username']} ha inviato: {message['content']}\n"
-            elif message['type'] in ["photo", "sticker"]: tasks.append(self._analyze_and_append(message, self.analyze_image, "ha inviato un'immagine"))
-            elif message['type'] in ["voice", "audio"]: tasks.append(self._analyze_and_append(message, self.analyze_audio, "ha inviato un audio"))
-            elif message['type'] in ['video', 'animation', 'video_note']: tasks.append(self._analyze_and_append(message, self.analyze_video, "ha inviato un video"))
-            elif message['type'] == 'document': tasks.append(self._analyze_and_append(message, self.analyze_document, "ha inviato un documento"))
-        await asyncio.gather(*tasks)
-        eval.stop("Analyzer")
-        return await self.generate_summary(context,preferences)
+            if message['type'] == 'text': tasks.append(self._text_line(message))
+            elif message['type'] in ["photo", "sticker"]: tasks.append(self._analyze_line(message, self.analyze_image, "ha inviato un'immagine"))
+            elif message['type'] in ["voice", "audio"]: tasks.append(self._analyze_line(message, self.analyze_audio, "ha inviato un audio"))
+            elif message['type'] in ['video', 'animation', 'video_note']: tasks.append(self._analyze_line(message, self.analyze_video, "ha inviato un video"))
+            elif message['type'] == 'document': tasks.append(self._analyze_line(message, self.analyze_document, "ha inviato un documento"))
+        lines = await asyncio.gather(*tasks)
+        return "".join(lines)
 
-    async def _analyze_and_append(self, message, analysis_func, description):
-        result = await analysis_func(message)
-        self.summary += f"[{message['timestamp']}] {message['username']} {description}: {result}\n"
+    async def _text_line(self, message):
+        return f"[{message['timestamp']}] {message['username']} ha inviato: {message['content']}\n"
+
+    async def _analyze_line(self, message, analysis_func, description):
+        result = await media_cache.get_or_analyze(message, analysis_func)
+        return f"[{message['timestamp']}] {message['username']} {description}: {result}\n"
 
     @backoff_decorator(retries=5, base_delay=1, max_delay=16)
     async def analyze_image(self, message):
@@ -74,7 +149,7 @@ class NLP:
             "\n\nDevi creare una descrizione concisa dell'immagine che possa essere integrata in un riassunto della conversazione."
         )
         try:
-            response = await self.client.chat.completions.create(
+            response = await self.chat_completion(
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": [{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": message["content"]}}]}],
                 max_tokens=200,
@@ -86,87 +161,70 @@ class NLP:
 
     @backoff_decorator(retries=5, base_delay=1, max_delay=16)
     async def analyze_audio(self, message):
-        audio_file_name = "audio_file.mp3"
         try:
-            if message["content"].startswith("http://") or message["content"].startswith("https://"):
-                await self.download_file(message["content"], audio_file_name)
-            else:
-                self.copy_local_file(message["content"], audio_file_name)
-
-            with open(audio_file_name, "rb") as f:
-                transcript_response = await self.client.audio.transcriptions.create(model="whisper-1", file=f, response_format="text")
+            # L'audio resta in memoria e viene passato direttamente a Whisper
+            audio_buffer = await self.fetch_media(message["content"])
+            audio_name = self.media_file_name(message["content"], "audio.mp3")
+            transcript_response = await self.transcribe(
+                model="whisper-1", file=(audio_name, audio_buffer), response_format="text"
+            )
             return transcript_response.strip() if transcript_response else ""
         except Exception as e:
             logger.error(f"Errore durante la trascrizione: {e}")
             return ""
-        finally:
-            if os.path.exists(audio_file_name):
-                os.remove(audio_file_name)
 
     @backoff_decorator(retries=5, base_delay=1, max_delay=16)
     async def analyze_video(self, message):
-        video_file_name = "temp_video.mp4"
-        audio_file_name = "temp_audio.mp3"
         prompt = (
             "Analizza il contenuto visivo e, se presente, l'audio di questo video. "
             f"Descrivi il video brevemente in modo che possa essere compreso in un riassunto di una chat di gruppo. "
             f"{'Caption fornita dall’utente: ' + message['caption'] if message['caption'] else ''}"
         )
         try:
-            # Scarica il file video
-            if message["content"].startswith("http://") or message["content"].startswith("https://"):
-                await self.download_file(message["content"], video_file_name)
-            else:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(None, self.copy_local_file, message["content"], video_file_name)
-
-            if not os.path.exists(video_file_name):
-                raise FileNotFoundError(f"Il file video '{video_file_name}' non è stato creato correttamente.")
-
-            # Verifica se il video contiene una traccia audio
-            video_clip = VideoFileClip(video_file_name)
-            has_audio = video_clip.audio is not None
-            if has_audio:
-                video_clip.audio.write_audiofile(audio_file_name)
-            video_clip.close()
-
-            # Leggi i fotogrammi del video
-            video = cv2.VideoCapture(video_file_name)
-            base64Frames = []
-            while video.isOpened():
-                success, frame = video.read()
-                if not success:
-                    break
-                _, buffer = cv2.imencode(".jpg", frame)
-                base64Frames.append(base64.b64encode(buffer).decode("utf-8"))
-            video.release()
-
-            # Crea i messaggi di prompt
-            PROMPT_MESSAGES = [
-                {
-                    "role": "user",
-                    "content": [
-                        prompt,
-                        *map(lambda x: {"image": x, "resize": 768}, base64Frames[0::60]),
-                    ],
-                },
-            ]
-
-            video_task = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=PROMPT_MESSAGES,
-                max_tokens=200,
-            )
-
-            # Trascrizione dell'audio, se presente
-            if has_audio:
-                with open(audio_file_name, "rb") as f:
-                    audio_task = self.client.audio.transcriptions.create(
-                        model="whisper-1", file=f, response_format="text"
+            with temp_media_path(".mp4") as downloaded_video, temp_media_path(".mp3") as audio_file_name, \
+                    tempfile.TemporaryDirectory(dir=Config.MEDIA_TEMP_DIR) as frames_dir:
+                # Scarica il file video; i file locali vengono letti direttamente, senza copia
+                if is_url(message["content"]):
+                    await self.download_file(message["content"], downloaded_video)
+                    video_file_name = downloaded_video
+                else:
+                    video_file_name = message["content"]
+
+                if not os.path.exists(video_file_name):
+                    raise FileNotFoundError(f"Il file video '{video_file_name}' non esiste.")
+
+                # Un'unica decodifica fuori dall'event loop produce audio mono e fotogrammi campionati
+                audio_task, frames_task = demux_video(video_file_name, audio_file_name, frames_dir)
+
+                async def describe_frames():
+                    base64Frames = await frames_task
+                    PROMPT_MESSAGES = [
+                        {
+                            "role": "user",
+                            "content": [
+                                prompt,
+                                *map(lambda x: {"image": x, "resize": Config.VIDEO_FRAME_MAX_SIDE}, base64Frames),
+                            ],
+                        },
+                    ]
+                    return await self.chat_completion(
+                        model="gpt-4o-mini",
+                        messages=PROMPT_MESSAGES,
+                        max_tokens=200,
                     )
-                    video_result, transcript_result = await asyncio.gather(video_task, audio_task)
-            else:
-                video_result, transcript_result = await asyncio.gather(video_task, None)
+
+                async def transcribe_audio():
+                    # Trascrizione dell'audio, se presente, appena la traccia è pronta
+                    if not await audio_task:
+                        return None
+                    with open(audio_file_name, "rb") as f:
+                        return await self.transcribe(model="whisper-1", file=f, response_format="text")
+
+                try:
+                    video_result, transcript_result = await asyncio.gather(describe_frames(), transcribe_audio())
+                finally:
+                    # I file temporanei vengono rimossi solo dopo la fine della separazione
+                    await asyncio.gather(audio_task, frames_task, return_exceptions=True)
 
             # Estrai e processa i risultati
             video_description = video_result.choices[0].message.content.strip() if video_result else ""
@@ -181,7 +239,7 @@ class NLP:
                     "Fornisci un riassunto che combini la descrizione del video e il contenuto del messaggio audio."
                 )
 
-                response = await self.client.chat.completions.create(
+                response = await self.chat_completion(
                     model="gpt-4o-mini",
                     messages=[{"role": "user", "content": final_prompt}],
                     max_tokens=200,
@@ -194,12 +252,6 @@ class NLP:
         except Exception as e:
             logger.error(f"Errore durante l'analisi del video o dell'audio: {e}")
             return ""
-        finally:
-            # Rimuovi i file temporanei solo dopo il completamento delle operazioni
-            if os.path.exists(video_file_name):
-                os.remove(video_file_name)
-            if os.path.exists(audio_file_name):
-                os.remove(audio_file_name)
 
     @backoff_decorator(retries=5, base_delay=1, max_delay=16)
     async def analyze_document(self, message):
@@ -210,16 +262,13 @@ class NLP:
             "Includi solo le informazioni principali, come argomenti trattati, conclusioni o dati rilevanti."
         )
 
-        file_path = "temp_file"
         try:
-            if message["content"].startswith("http://") or message["content"].startswith("https://"):
-                await self.download_file(message["content"],file_path)
-            else:
-                self.copy_local_file(message["content"], file_path)
-
-            document_content = self.extract_content(file_path)
+            document_buffer = await self.fetch_media(message["content"], Config.DOCUMENT_MAX_BYTES)
+            document_name = self.media_file_name(message["content"], "document")
+            # Estrazione in un processo separato, limitata a DOCUMENT_TOKEN_BUDGET token
+            document_content = await document_extractor.extract(document_buffer.getvalue(), document_name)
             prompt = f"Riassumi brevemente questo documento:\n{document_content}"
-            document_summary = await self.client.chat.completions.create(
+            document_summary = await self.chat_completion(
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=200,
@@ -228,29 +277,51 @@ class NLP:
         except Exception as e:
             logger.error(f"Errore nell'analisi del documento: {e}")
             return ""
-        finally:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-    def copy_local_file(self, file_url, file_path):
-        if os.path.exists(file_url):
-            shutil.copy(file_url, file_path)
-        else:
-            raise FileNotFoundError(f"Il file locale '{file_url}' non esiste.")
-
-    async def download_file(self, file_url, file_path):
-        async with httpx.AsyncClient() as client:
-            response = await client.get(file_url)
-            response.raise_for_status()
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
 
-    def extract_content(self, file_path):
-        elements = partition(filename=file_path)
-        return "\n".join([element.text for element in elements if element.text])
-
-    async def generate_summary(self, context, preferences):
-        original_text = f"{context}\n{self.summary}" if context else self.summary
+    def media_file_name(self, source, default):
+        # Nome usato per indicare il formato del file alle API (es. "voice.oga")
+        name = os.path.basename(urlparse(source).path if is_url(source) else source)
+        return name if "." in name else default
+
+    async def fetch_media(self, source, max_bytes=None):
+        """Restituisce il contenuto del media in un buffer in memoria, scaricandolo in streaming se remoto."""
+        if is_url(source):
+            buffer = io.BytesIO()
+            await self.stream_download(source, buffer.write, max_bytes)
+            buffer.seek(0)
+            return buffer
+        return await asyncio.to_thread(self.read_local_file, source, max_bytes)
+
+    def read_local_file(self, file_path, max_bytes=None):
+        max_bytes = max_bytes or Config.MAX_MEDIA_BYTES
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Il file locale '{file_path}' non esiste.")
+        if os.path.getsize(file_path) > max_bytes:
+            raise MediaTooLargeError(f"Il file '{file_path}' supera il limite di {max_bytes} byte.")
+        with open(file_path, 'rb') as f:
+            return io.BytesIO(f.read())
+
+    async def download_file(self, file_url, file_path, max_bytes=None):
+        with open(file_path, 'wb') as f:
+            await self.stream_download(file_url, f.write, max_bytes)
+
+    async def stream_download(self, file_url, write, max_bytes=None):
+        # Scarica a blocchi, interrompendo il download appena si supera il limite
+        max_bytes = max_bytes or Config.MAX_MEDIA_BYTES
+        async with get_http_client().stream("GET", file_url) as response:
+            response.raise_for_status()
+            declared_size = int(response.headers.get("content-length") or 0)
+            if declared_size > max_bytes:
+                raise MediaTooLargeError(f"Il file remoto supera il limite di {max_bytes} byte.")
+            received = 0
+            async for chunk in response.aiter_bytes(Config.DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise MediaTooLargeError(f"Il file remoto supera il limite di {max_bytes} byte.")
+                write(chunk)
+
+    async def generate_summary(self, transcript, context, preferences, chat_id=None):
+        original_text = f"{context}\n{transcript}" if context else transcript
         language = preferences["Lingua"]
         length = preferences["Lunghezza Riassunto"]
         filter = preferences["Filtro"]
@@ -259,21 +330,121 @@ class NLP:
         max_tokens = 150 if length == "breve" else 300 if length == "medio" else 600
 
         try:
-            messages = self.create_summary_prompt(language, length, filter, context, self.summary)
-            print("Testo analizzato: ",self.summary)
-            response = await self.client.chat.completions.create(
+            # La riduzione usa lo stesso budget della compattazione: compact_transcript non scarta contenuto
+            budget = self.conversation_budget(language, length, filter, context)
+            if count_tokens(transcript) > budget:
+                transcript = await self.reduce_transcript(transcript, language, filter, budget)
+            messages = self.create_summary_prompt(language, length, filter, context, transcript)
+            print("Testo analizzato: ",transcript)
+            response = await self.chat_completion(
                 model="gpt-4o-mini",
                 messages=messages,
                 max_tokens=max_tokens
             )
             generated_summary = response.choices[0].message.content if response else ""
-            result = await self.fidality.run_all_tests(generated_summary, original_text)
-            self.summary = ""
+            # La valutazione della qualità avviene in background, senza ritardare la risposta
+            evaluation_worker.submit(generated_summary, original_text, chat_id)
             return generated_summary
         except Exception as e:
             logger.error(f"Errore nel riassunto: {e}")
             return ""
 
+    async def reduce_transcript(self, transcript, language, filter, budget):
+        """
+        Riduce una trascrizione troppo lunga con un approccio map-reduce.
+
+        La trascrizione viene divisa in segmenti di SUMMARY_CHUNK_TOKENS token, riassunti in parallelo;
+        i riassunti parziali sostituiscono la trascrizione finché non rientra in 'budget' token. Si ferma
+        dopo SUMMARY_MAX_PASSES passaggi o quando un passaggio non accorcia la trascrizione; il resto
+        viene compattato da create_summary_prompt.
+        """
+        semaphore = asyncio.Semaphore(Config.SUMMARY_MAP_CONCURRENCY)
+
+        async def summarize_with_limit(chunk, index, total):
+            async with semaphore:
+                return await self.summarize_chunk(chunk, language, filter, index, total)
+
+        tokens = count_tokens(transcript)
+        for _ in range(Config.SUMMARY_MAX_PASSES):
+            if tokens <= budget:
+                break
+            chunks = split_by_tokens(transcript, min(Config.SUMMARY_CHUNK_TOKENS, budget))
+            if len(chunks) < 2:
+                break
+            logger.info(f"Trascrizione divisa in {len(chunks)} segmenti per il riassunto gerarchico.")
+            partial_summaries = await asyncio.gather(
+                *[summarize_with_limit(chunk, index, len(chunks)) for index, chunk in enumerate(chunks, start=1)]
+            )
+            reduced = "\n\n".join(
+                f"Riassunto parziale {index}/{len(chunks)}:\n{partial}"
+                for index, partial in enumerate(partial_summaries, start=1) if partial
+            )
+            reduced_tokens = count_tokens(reduced)
+            if reduced_tokens >= tokens:
+                # Budget vicino alla lunghezza dei riassunti parziali: altri passaggi non convergerebbero
+                logger.warning(f"Riassunto gerarchico interrotto: {tokens} token ridotti a {reduced_tokens}.")
+                break
+            transcript, tokens = reduced, reduced_tokens
+        return transcript
+
+    async def summarize_chunk(self, chunk, language, filter, index, total):
+        prompt = (
+            f"Questa è la parte {index} di {total} di una conversazione di chat di gruppo, in ordine cronologico.\n"
+            f"Riassumila in {language}, conservando chi ha detto cosa, decisioni, domande e orari rilevanti"
+            f"{', concentrandoti sul tema: ' + filter if filter else ''}.\n\n"
+            f"{chunk}"
+        )
+        try:
+            response = await self.chat_completion(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=Config.SUMMARY_CHUNK_MAX_TOKENS,
+            )
+            return response.choices[0].message.content.strip() if response else ""
+        except Exception as e:
+            logger.error(f"Errore nel riassunto del segmento {index}/{total}: {e}")
+            return ""
+
+    def summary_prompt_parts(self, language, length, filter, context):
+        """Restituisce il prompt di sistema e la funzione che inserisce la conversazione nel prompt utente."""
+        system_prompt = (
+            "Sei un assistente AI specializzato nel riassumere conversazioni di chat di gruppo in modo conciso e informativo. "
+            "Il tuo obiettivo è estrarre i punti chiave, evidenziare i contributi significativi di ciascun partecipante e identificare "
+            "decisioni importanti, domande, risposte e cambiamenti emotivi rilevanti. "
+            "Mantieni il tono naturale della conversazione e rispetta lo stile originale."
+        )
+
+        def render_user_prompt(conversation):
+            return (
+                f"Il seguente testo è una conversazione di chat di gruppo che necessita di essere riassunta.\n\n"
+                f"**Lingua del riassunto:** {language}\n"
+                f"**Lunghezza desiderata:** {length}\n"
+                f"**Filtro tematico:** {filter if filter else 'Nessun filtro specifico'}\n\n"
+                f"**Contesto della conversazione:**\n"
+                f"{context if context else 'Nessun contesto specifico'}\n\n"
+                f"**Conversazione:**\n"
+                f"{conversation}\n\n"
+                "Per favore, riassumi la conversazione sopra riportata seguendo queste linee guida:\n\n"
+                "- Utilizza la lingua specificata.\n"
+                "- Se è presente un contesto usa anche quello per creare un riassunto ottimizzato ed attinente\n"
+                "- Se è presente un filtro riassumi solo gli argomenti che parlano di quel tema\n"
+                "- Mantieni uno stile che rispecchi il tono della chat originale.\n"
+                "- Evidenzia i contributi significativi di ciascun partecipante.\n"
+                "- Indica i momenti importanti, le decisioni chiave e i cambiamenti emotivi.\n"
+                "- Sintetizza i temi o gli argomenti principali con dettagli concreti.\n"
+                "- Mantieni il riassunto entro la lunghezza desiderata.\n"
+                "-Analizza e riassumi i messaggi in ordine cronologico basato sui timestamp, mantenendo la sequenza temporale.\n\n"
+                "Il tuo riassunto dovrebbe fornire una panoramica completa dell'interazione tra i partecipanti e dei principali argomenti discussi."
+            )
+
+        return system_prompt, render_user_prompt
+
+    def conversation_budget(self, language, length, filter, context):
+        """Token disponibili per la conversazione: il budget in input meno le parti fisse del prompt."""
+        system_prompt, render_user_prompt = self.summary_prompt_parts(language, length, filter, context)
+        overhead = count_tokens(system_prompt) + count_tokens(render_user_prompt(""))
+        return input_budget(length) - overhead
+
     def create_summary_prompt(self, language, length, filter, context, summary):
         """
         Genera un prompt personalizzato per riassumere una conversazione di gruppo.
@@ -288,33 +459,11 @@ class NLP:
         Returns:
         - Un prompt ottimizzato per la generazione del riassunto.
         """
-        system_prompt = (
-            "Sei un assistente AI specializzato nel riassumere conversazioni di chat di gruppo in modo conciso e informativo. "
-            "Il tuo obiettivo è estrarre i punti chiave, evidenziare i contributi significativi di ciascun partecipante e identificare "
-            "decisioni importanti, domande, risposte e cambiamenti emotivi rilevanti. "
-            "Mantieni il tono naturale della conversazione e rispetta lo stile originale."
-        )
-        user_prompt = (
-            f"Il seguente testo è una conversazione di chat di gruppo che necessita di essere riassunta.\n\n"
-            f"**Lingua del riassunto:** {language}\n"
-            f"**Lunghezza desiderata:** {length}\n"
-            f"**Filtro tematico:** {filter if filter else 'Nessun filtro specifico'}\n\n"
-            f"**Contesto della conversazione:**\n"
-            f"{context if context else 'Nessun contesto specifico'}\n\n"
-            f"**Conversazione:**\n"
-            f"{summary}\n\n"
-            "Per favore, riassumi la conversazione sopra riportata seguendo queste linee guida:\n\n"
-            "- Utilizza la lingua specificata.\n"
-            "- Se è presente un contesto usa anche quello per creare un riassunto ottimizzato ed attinente\n"
-            "- Se è presente un filtro riassumi solo gli argomenti che parlano di quel tema\n"
-            "- Mantieni uno stile che rispecchi il tono della chat originale.\n"
-            "- Evidenzia i contributi significativi di ciascun partecipante.\n"
-            "- Indica i momenti importanti, le decisioni chiave e i cambiamenti emotivi.\n"
-            "- Sintetizza i temi o gli argomenti principali con dettagli concreti.\n"
-            "- Mantieni il riassunto entro la lunghezza desiderata.\n"
-            "-Analizza e riassumi i messaggi in ordine cronologico basato sui timestamp, mantenendo la sequenza temporale.\n\n"
-            "Il tuo riassunto dovrebbe fornire una panoramica completa dell'interazione tra i partecipanti e dei principali argomenti discussi."
-        )
+        system_prompt, render_user_prompt = self.summary_prompt_parts(language, length, filter, context)
+        # Rete di sicurezza: la trascrizione è già stata ridotta entro lo stesso budget
+        conversation = compact_transcript(summary, self.conversation_budget(language, length, filter, context))
+        user_prompt = render_user_prompt(conversation)
+
         combined_prompt = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -323,4 +472,12 @@ class NLP:
         return combined_prompt
 
 
+# Istanza unica del servizio NLP per processo
+_nlp_service = None
+
 
+def get_nlp_service():
+    global _nlp_service
+    if _nlp_service is None:
+        _nlp_service = NLP()
+    return _nlp_service
@@ -0,0 +1,231 @@
+# openai_scheduler.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+
+from config import Config
+
+# Configurazione del logger
+logger = logging.getLogger("openai_scheduler")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # /summarize richiesto dall'utente
+    AUTO = 1  # Riassunti automatici (soglia di messaggi o timer)
+    DAILY = 2  # Riassunti giornalieri
+    EVALUATION = 3  # Valutazioni e lavori in background
+
+
+# Priorità della richiesta corrente, propagata automaticamente ai task figli
+current_priority = contextvars.ContextVar("openai_priority", default=Priority.AUTO)
+
+
+@contextmanager
+def request_priority(priority):
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class TokenBucket:
+    """Secchio che si ricarica in modo continuo fino a 'capacity' unità al minuto."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        # Una richiesta più grande del secchio attende solo di trovarlo pieno
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing * 60 / self.capacity)
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+
+class _Ticket:
+    __slots__ = ("priority", "estimated_tokens", "enqueued_at", "future")
+
+    def __init__(self, priority, estimated_tokens, future):
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class OpenAIScheduler:
+    """
+    Coda unica per tutte le richieste a OpenAI.
+
+    Le richieste vengono servite per priorità (e in ordine di arrivo a parità di priorità) solo quando
+    i budget di richieste e token al minuto e il limite di concorrenza lo consentono. Un 429 sospende
+    l'intera coda per il tempo indicato da OpenAI, invece di far ritentare ogni chiamata per conto suo.
+    Nei worker di shard_router 'remote' inoltra permessi e sospensioni al processo principale, che
+    possiede l'unico budget.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None):
+        self.requests = TokenBucket(requests_per_minute or Config.OPENAI_RPM)
+        self.tokens = TokenBucket(tokens_per_minute or Config.OPENAI_TPM)
+        self.max_concurrency = max_concurrency or Config.NLP_MAX_CONCURRENCY
+
+        self.queue = []
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.wakeup = None
+        self.dispatcher = None
+        self.remote = None
+
+        self.granted = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _ensure_started(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+    async def acquire(self, priority, estimated_tokens):
+        """Attende il turno della richiesta; il permesso restituito va passato a release()."""
+        if self.remote is not None:
+            permit = await self.remote.acquire(priority, estimated_tokens)
+            self.in_flight += 1
+            return permit
+        self._ensure_started()
+        ticket = _Ticket(priority, estimated_tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.queue, (priority, next(self.sequence), ticket))
+        self.wakeup.set()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # Annullata dopo aver ottenuto il turno: lo slot va restituito
+            if ticket.future.done() and not ticket.future.cancelled():
+                self.release()
+            raise
+
+    def release(self, permit=None):
+        self.in_flight -= 1
+        if self.remote is not None:
+            self.remote.release(permit)
+        else:
+            self.wakeup.set()
+
+    async def run(self, request_factory, estimated_tokens=0, priority=None):
+        """Esegue request_factory() quando c'è budget; ritenta gli errori transitori rimettendosi in coda."""
+        import openai
+
+        priority = current_priority.get() if priority is None else priority
+        for attempt in range(Config.OPENAI_MAX_RETRIES + 1):
+            permit = await self.acquire(priority, estimated_tokens)
+            delay = 0
+            try:
+                return await request_factory()
+            except openai.RateLimitError as e:
+                self.rate_limited += 1
+                if attempt == Config.OPENAI_MAX_RETRIES:
+                    raise
+                retry_after = self._retry_after(e) or min(2 ** attempt, 30)
+                logger.warning(f"Limite di OpenAI raggiunto, coda sospesa per {retry_after:.1f} secondi.")
+                self.pause(retry_after)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == Config.OPENAI_MAX_RETRIES:
+                    raise
+                delay = min(2 ** attempt + random.uniform(0, 1), 30)
+                logger.warning(f"Errore transitorio di OpenAI: {e}, ritento tra {delay:.2f} secondi...")
+            finally:
+                self.release(permit)
+            # L'attesa avviene dopo aver restituito lo slot, che resta disponibile alle altre richieste
+            if delay:
+                await asyncio.sleep(delay)
+
+    def _retry_after(self, error):
+        response = getattr(error, "response", None)
+        try:
+            return float(response.headers.get("retry-after"))
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def pause(self, seconds):
+        if self.remote is not None:
+            self.remote.pause(seconds)
+            return
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def _wait_for_wakeup(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def _dispatch(self):
+        while True:
+            # Scarta le richieste annullate mentre erano in coda
+            while self.queue and self.queue[0][2].future.done():
+                heapq.heappop(self.queue)
+            if not self.queue or self.in_flight >= self.max_concurrency:
+                await self._wait_for_wakeup()
+                continue
+
+            ticket = self.queue[0][2]
+            delay = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(ticket.estimated_tokens),
+            )
+            if delay > 0:
+                # Un arrivo a priorità più alta o un rilascio riattivano subito la valutazione
+                await self._wait_for_wakeup(delay)
+                continue
+
+            heapq.heappop(self.queue)
+            self.requests.consume(1)
+            self.tokens.consume(ticket.estimated_tokens)
+            self.in_flight += 1
+            waited = time.monotonic() - ticket.enqueued_at
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            ticket.future.set_result(None)
+
+    def stats(self):
+        depth_by_priority = {priority.name: 0 for priority in Priority}
+        for priority, _, ticket in self.queue:
+            if not ticket.future.done():
+                depth_by_priority[Priority(priority).name] += 1
+        return {
+            "queue_depth": sum(depth_by_priority.values()),
+            "queue_depth_by_priority": depth_by_priority,
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "average_wait": self.total_wait / self.granted if self.granted else 0.0,
+            "max_wait": self.max_wait,
+            "paused_for": max(0.0, self.paused_until - time.monotonic()),
+        }
+
+
+scheduler = OpenAIScheduler()
@@ -0,0 +1,166 @@
+# prompt_builder.py
+
+import re
+
+from config import Config
+from tokenizer import count_tokens, truncate_to_tokens
+
+# Riga di trascrizione prodotta da NLP: "[timestamp] username ha inviato...: contenuto"
+LINE_PATTERN = re.compile(
+    r"^\[(?P<timestamp>[^\]]*)\] (?P<username>.+?) "
+    r"(?P<action>ha inviato(?: un'immagine| un audio| un video| un documento)?): (?P<content>.*)$"
+)
+TEXT_ACTION = "ha inviato"
+# Intestazione dei riassunti parziali prodotti da NLP.reduce_transcript
+PARTIAL_SUMMARY_PATTERN = re.compile(r"^Riassunto parziale \d+/\d+:")
+
+# Messaggi brevi che non aggiungono informazioni al riassunto
+FILLER_WORDS = {
+    "ok", "okay", "ok!", "si", "sì", "no", "ah", "oh", "eh", "boh", "mah", "lol", "xd",
+    "grazie", "grazie!", "prego", "ciao", "ciao!", "va bene", "perfetto", "top", "daje",
+    "thanks", "thx", "yes", "yep", "nope", "merci", "oui", "non",
+}
+FILLER_PATTERN = re.compile(r"^(?:[ahjk]*(?:ah|ha|eh|he)[ahjk]*|[\W_]+)$", re.IGNORECASE)
+
+OMITTED_MARKER = "[... {count} messaggi precedenti omessi ...]"
+
+
+class TranscriptEntry:
+    __slots__ = ("timestamp", "username", "action", "content")
+
+    def __init__(self, timestamp, username, action, content):
+        self.timestamp = timestamp
+        self.username = username
+        self.action = action
+        self.content = content
+
+    @property
+    def is_text(self):
+        return self.action == TEXT_ACTION
+
+    def render(self):
+        if self.username is None:
+            return self.content
+        return f"[{self.timestamp}] {self.username} {self.action}: {self.content}"
+
+
+def input_budget(length):
+    """Token di input consentiti per una richiesta di riassunto della lunghezza indicata."""
+    budgets = {
+        "breve": Config.PROMPT_BUDGET_BREVE,
+        "medio": Config.PROMPT_BUDGET_MEDIO,
+        "lungo": Config.PROMPT_BUDGET_LUNGO,
+    }
+    return budgets.get(length, Config.PROMPT_BUDGET_MEDIO)
+
+
+def parse_transcript(transcript):
+    """
+    Divide la trascrizione in voci: una per messaggio.
+
+    Il testo senza intestazione (riassunti parziali, testo incollato) viene diviso sulle righe vuote e
+    sulle intestazioni "Riassunto parziale i/N:", così la compattazione può ometterne solo una parte.
+    """
+    entries, paragraph_break = [], False
+    for line in transcript.splitlines():
+        match = LINE_PATTERN.match(line)
+        if match:
+            entries.append(TranscriptEntry(**match.groupdict()))
+            paragraph_break = False
+        elif PARTIAL_SUMMARY_PATTERN.match(line):
+            entries.append(TranscriptEntry(None, None, None, line))
+            paragraph_break = False
+        elif not line.strip():
+            if entries and entries[-1].username is None:
+                paragraph_break = True
+            elif entries:
+                entries[-1].content += "\n" + line
+        elif entries and not (entries[-1].username is None and paragraph_break):
+            # Le descrizioni dei media e i paragrafi possono occupare più righe
+            entries[-1].content += "\n" + line
+        else:
+            entries.append(TranscriptEntry(None, None, None, line))
+            paragraph_break = False
+    return entries
+
+
+def render_transcript(entries):
+    parts = []
+    for entry in entries:
+        # Le voci senza intestazione restano separate da una riga vuota, come nell'originale
+        if parts and entry.username is None:
+            parts.append("")
+        parts.append(entry.render())
+    return "\n".join(parts)
+
+
+def _trim_media_descriptions(entries):
+    for entry in entries:
+        if entry.username is not None and not entry.is_text:
+            trimmed = truncate_to_tokens(entry.content, Config.PROMPT_MEDIA_DESCRIPTION_TOKENS)
+            if trimmed != entry.content:
+                entry.content = trimmed.rstrip() + "…"
+    return entries
+
+
+def _is_filler(entry):
+    content = entry.content.strip().lower()
+    return entry.is_text and (content in FILLER_WORDS or bool(FILLER_PATTERN.match(content)))
+
+
+def _drop_filler(entries):
+    return [entry for entry in entries if not _is_filler(entry)]
+
+
+def _collapse_consecutive(entries):
+    # Unisce i messaggi di testo consecutivi dello stesso utente mantenendo il primo timestamp
+    collapsed = []
+    for entry in entries:
+        previous = collapsed[-1] if collapsed else None
+        if previous and entry.is_text and previous.is_text and previous.username == entry.username:
+            previous.content += " / " + entry.content
+        else:
+            collapsed.append(entry)
+    return collapsed
+
+
+def _keep_most_recent(entries, budget):
+    # Ultima risorsa: mantiene i messaggi più recenti che rientrano nel budget
+    kept, used = [], count_tokens(OMITTED_MARKER.format(count=len(entries)))
+    for entry in reversed(entries):
+        entry_tokens = count_tokens(entry.render()) + 1
+        if used + entry_tokens > budget:
+            break
+        kept.append(entry)
+        used += entry_tokens
+    if not kept and entries:
+        # Nemmeno la voce più recente rientra: viene troncata invece di essere omessa
+        newest = entries[-1]
+        header_tokens = count_tokens(TranscriptEntry(newest.timestamp, newest.username, newest.action, "").render())
+        content = truncate_to_tokens(newest.content, max(1, budget - used - header_tokens - 2))
+        kept.append(TranscriptEntry(newest.timestamp, newest.username, newest.action, content.rstrip() + "…"))
+    kept.reverse()
+    omitted = len(entries) - len(kept)
+    if omitted:
+        kept.insert(0, TranscriptEntry(None, None, None, OMITTED_MARKER.format(count=omitted)))
+    return kept
+
+
+def compact_transcript(transcript, budget):
+    """
+    Riduce in modo deterministico una trascrizione finché non rientra nel budget di token.
+
+    I passaggi vengono applicati in ordine, fermandosi al primo sufficiente: accorcia le descrizioni
+    dei media, rimuove i messaggi di riempimento, unisce i messaggi consecutivi dello stesso utente
+    e infine omette i messaggi più vecchi.
+    """
+    if count_tokens(transcript) <= budget:
+        return transcript
+
+    entries = parse_transcript(transcript)
+    for step in (_trim_media_descriptions, _drop_filler, _collapse_consecutive):
+        entries = step(entries)
+        compacted = render_transcript(entries)
+        if count_tokens(compacted) <= budget:
+            return compacted
+    return render_transcript(_keep_most_recent(entries, budget))
@@ -1,19 +1,134 @@
 #session_manager.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from async_database import get_daily_schedules
+from config import Config
 from user_session import UserSession
 
+# Configurazione del logger
+logger = logging.getLogger("session_manager")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
 class SessionManager:
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(SessionManager, cls).__new__(cls)
-            cls._instance.sessions = {}
+            cls._instance.sessions = OrderedDict()  # Ordine LRU: le sessioni meno recenti in testa
+            cls._instance.last_access = {}
+            cls._instance.max_resident = Config.SESSION_MAX_RESIDENT
+            cls._instance.idle_ttl = Config.SESSION_IDLE_TTL
+            cls._instance.sweeper_task = None
+            cls._instance.loading = {}  # chat_id -> task di caricamento condiviso dalle richieste concorrenti
+            cls._instance.evicted = 0
         return cls._instance
 
     async def get_session(self, chat_id):
+        self._ensure_sweeper()
         if chat_id not in self.sessions:
-            self.sessions[chat_id] = await UserSession.create(chat_id) 
+            # Un solo caricamento per chat: le richieste concorrenti attendono lo stesso task
+            task = self.loading.get(chat_id)
+            if task is None:
+                task = asyncio.create_task(self._load(chat_id))
+                self.loading[chat_id] = task
+                task.add_done_callback(lambda _: self.loading.pop(chat_id, None))
+            await asyncio.shield(task)
+        self.sessions.move_to_end(chat_id)
+        self.last_access[chat_id] = time.monotonic()
+        if len(self.sessions) > self.max_resident:
+            await self.evict_over_capacity()
         return self.sessions[chat_id]
 
+    async def _load(self, chat_id):
+        # Ricostruisce la sessione da preferenze e stato salvati
+        session = await UserSession.create(chat_id)
+        self.sessions[chat_id] = session
+        self.last_access[chat_id] = time.monotonic()
+        # Lo stato salvato viene eliminato solo ora che la sessione è raggiungibile
+        await session.activate()
+
+    async def evict(self, chat_id):
+        session = self.sessions.get(chat_id)
+        if session is None or session.lock.locked():
+            return False
+        accessed_at = self.last_access.get(chat_id)
+        try:
+            await session.evict()
+        except Exception as e:
+            logger.error(f"Errore durante la rimozione della sessione {chat_id}: {e}")
+            await self._keep(chat_id, session)
+            return False
+        # Se la sessione è stata usata durante il salvataggio resta in memoria
+        if self.last_access.get(chat_id) != accessed_at:
+            await self._keep(chat_id, session)
+            return False
+        self.sessions.pop(chat_id, None)
+        self.last_access.pop(chat_id, None)
+        self.evicted += 1
+        return True
+
+    async def _keep(self, chat_id, session):
+        # Rimozione annullata: lo stato appena salvato va eliminato (ricaricarlo dopo un arresto riporterebbe
+        # indietro il riassunto) e il timer annullato da evict va riarmato
+        try:
+            await session.activate()
+        except Exception as e:
+            logger.error(f"Errore durante il ripristino della sessione {chat_id}: {e}")
+
+    async def checkpoint_all(self):
+        """Salva messaggi e stato di tutte le sessioni residenti, saltando quelle occupate."""
+        for chat_id, session in list(self.sessions.items()):
+            if session.lock.locked():
+                continue
+            try:
+                await session.checkpoint()
+            except Exception as e:
+                logger.error(f"Errore durante il salvataggio della sessione {chat_id}: {e}")
+
+    async def evict_over_capacity(self):
+        # Rimuove le sessioni meno usate di recente, saltando quelle occupate
+        for chat_id in list(self.sessions)[:len(self.sessions) - self.max_resident]:
+            await self.evict(chat_id)
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        idle = [chat_id for chat_id, accessed_at in self.last_access.items() if now - accessed_at > self.idle_ttl]
+        for chat_id in idle:
+            await self.evict(chat_id)
+        if idle:
+            logger.info(f"Rimosse dalla memoria le sessioni inattive: {len(idle)} candidate, {len(self.sessions)} residenti.")
+
+    def _ensure_sweeper(self):
+        if self.sweeper_task is None or self.sweeper_task.done():
+            self.sweeper_task = asyncio.create_task(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(Config.SESSION_SWEEP_INTERVAL)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Errore durante la rimozione delle sessioni inattive: {e}")
+
+    async def get_daily_schedules(self):
+        """Orari dei riassunti giornalieri: quelli salvati, aggiornati con le preferenze delle sessioni residenti."""
+        schedules = await get_daily_schedules()
+        for chat_id, session in self.sessions.items():
+            if session.preferences["Auto-Riassunto"]:
+                schedules[chat_id] = (session.preferences["Fuso Orario"], session.preferences["Ora Riassunto"])
+            else:
+                schedules.pop(chat_id, None)
+        return schedules
+
+    def stats(self):
+        return {"resident": len(self.sessions), "max_resident": self.max_resident, "evicted": self.evicted}
+
     def clear_all_sessions(self):
         self.sessions.clear()
+        self.last_access.clear()
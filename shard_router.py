@@ -0,0 +1,369 @@
+# shard_router.py
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+
+from config import Config
+from openai_scheduler import Priority, current_priority, request_priority, scheduler
+
+# Configurazione del logger
+logger = logging.getLogger("shard_router")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Metodi di UserSession invocabili dal processo principale (comandi del bot e riassunti giornalieri)
+REMOTE_METHODS = frozenset({
+    "get_preference", "update_preference", "get_summary", "daily_store",
+    "add_pending_filter", "remove_pending_filter", "is_pending_filter",
+})
+
+
+class ShardUnavailableError(Exception):
+    """Il worker della chat è terminato prima di rispondere."""
+
+
+class RemoteCallError(Exception):
+    """Eccezione sollevata nel worker durante l'elaborazione di una richiesta."""
+
+
+def shard_for(chat_id, shards):
+    return chat_id % shards
+
+
+# Processo worker
+
+class FrontClient:
+    """
+    Servizi del processo principale usati da un worker.
+
+    Il budget di OpenAIScheduler e il pool di valutazione restano unici qualunque sia il numero di
+    worker: i permessi vengono chiesti al processo principale e le valutazioni gli vengono inoltrate.
+    """
+
+    def __init__(self, index, replies):
+        self.index = index
+        self.replies = replies
+        self.permit_ids = itertools.count()
+        self.waiting = {}  # permit_id -> future risolta quando il processo principale concede il turno
+
+    async def acquire(self, priority, estimated_tokens):
+        permit_id = next(self.permit_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[permit_id] = future
+        self.replies.put(("acquire", self.index, permit_id, int(priority), estimated_tokens))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Il processo principale annulla l'attesa o restituisce il permesso appena concesso
+            self.release(permit_id)
+            raise
+        finally:
+            self.waiting.pop(permit_id, None)
+        return permit_id
+
+    def granted(self, permit_id):
+        future = self.waiting.get(permit_id)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def release(self, permit_id):
+        self.replies.put(("release", self.index, permit_id))
+
+    def pause(self, seconds):
+        self.replies.put(("pause", self.index, seconds))
+
+    def evaluate(self, generated_summary, original_text, chat_id):
+        self.replies.put(("evaluate", self.index, generated_summary, original_text, chat_id))
+
+
+def run_worker(index, shards, requests, replies):
+    """Punto di ingresso di un worker: possiede le sessioni delle chat con shard_for(chat_id) == index."""
+    # Nel worker le sessioni sono locali: niente ulteriore suddivisione
+    Config.SHARD_WORKERS = 0
+    shard_router.workers = 0
+    # Le estrazioni dei documenti contemporanee sono ripartite tra i worker
+    Config.DOCUMENT_WORKERS = max(1, Config.DOCUMENT_WORKERS // shards)
+    asyncio.run(_worker_main(index, requests, replies))
+
+
+async def _worker_main(index, requests, replies):
+    import async_database
+    from document_extractor import document_extractor
+    from evaluation_worker import evaluation_worker
+    from http_client import close_http_client, start_http_client
+    from update_handler import handle_update, session_manager
+
+    front = FrontClient(index, replies)
+    scheduler.remote = front
+    evaluation_worker.remote = front
+    await start_http_client()
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def serve(request):
+        kind, request_id, chat_id, priority = request[:4]
+        try:
+            # Le richieste a OpenAI fatte per conto del processo principale ne mantengono la priorità
+            with request_priority(Priority(priority)):
+                if kind == "update":
+                    result = await handle_update(chat_id, request[4])
+                else:
+                    method, args = request[4], request[5]
+                    if method not in REMOTE_METHODS:
+                        raise AttributeError(f"Metodo non consentito: {method}")
+                    session = await session_manager.get_session(chat_id)
+                    result = await getattr(session, method)(*args)
+            replies.put(("reply", index, request_id, True, result))
+        except Exception as e:
+            logger.error(f"Worker {index}: errore nella richiesta {kind} della chat {chat_id}: {e}")
+            replies.put(("reply", index, request_id, False, f"{type(e).__name__}: {e}"))
+
+    async def checkpoint():
+        # Le sessioni vivono solo in questo processo: vengono salvate di continuo, non solo all'arresto
+        while True:
+            await asyncio.sleep(Config.SHARD_CHECKPOINT_INTERVAL)
+            await session_manager.checkpoint_all()
+
+    logger.info(f"Worker {index} avviato.")
+    checkpoint_task = asyncio.create_task(checkpoint())
+    try:
+        while True:
+            request = await loop.run_in_executor(None, requests.get)
+            if request is None:
+                break
+            if request[0] == "grant":
+                front.granted(request[1])
+                continue
+            task = asyncio.create_task(serve(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        checkpoint_task.cancel()
+        await asyncio.gather(checkpoint_task, *tasks, return_exceptions=True)
+        # Le sessioni vengono salvate: il worker che ripartirà le ricaricherà dal database
+        for chat_id in list(session_manager.sessions):
+            await session_manager.evict(chat_id)
+        await evaluation_worker.close()
+        document_extractor.close()
+        await close_http_client()
+        async_database.shutdown()
+        logger.info(f"Worker {index} arrestato.")
+
+
+# Processo principale
+
+class ShardRouter:
+    """
+    Instrada update e chiamate alle sessioni verso N processi worker, scelti con chat_id % N.
+
+    Ogni worker possiede le sessioni delle proprie chat; lo stato condiviso (preferenze, stato delle
+    sessioni, messaggi) è nel database SQLite. Il budget di OpenAI e il pool di valutazione restano
+    nel processo principale (vedi FrontClient). Un worker terminato viene riavviato e le richieste
+    rimaste senza risposta vengono ripetute.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = Config.SHARD_WORKERS if workers is None else workers
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.requests = []
+        self.replies = None
+        self.pending = {}  # request_id -> (shard, future)
+        self.permits = {}  # (shard, permit_id) -> task che attende il turno in OpenAIScheduler
+        self.request_ids = itertools.count()
+        self.loop = None
+        self.reader = None
+        self.monitor_task = None
+        self.restarts = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.replies = self.context.Queue()
+        self.processes = [None] * self.workers
+        self.requests = [None] * self.workers
+        for index in range(self.workers):
+            self._spawn(index)
+        self.reader = threading.Thread(target=self._read_replies, name="shard-replies", daemon=True)
+        self.reader.start()
+        self.monitor_task = asyncio.create_task(self._monitor())
+        logger.info(f"Avviati {self.workers} worker.")
+
+    def _spawn(self, index):
+        self.requests[index] = self.context.Queue()
+        # Non daemon: il worker deve poter creare il proprio pool di valutazione
+        process = self.context.Process(target=run_worker, args=(index, self.workers, self.requests[index], self.replies),
+                                       name=f"shard-{index}")
+        process.start()
+        self.processes[index] = process
+
+    def _read_replies(self):
+        while True:
+            reply = self.replies.get()
+            if reply is None:
+                return
+            self.loop.call_soon_threadsafe(self._handle, reply)
+
+    def _handle(self, message):
+        kind, index = message[:2]
+        if kind == "reply":
+            self._resolve(index, *message[2:])
+        elif kind == "acquire":
+            self._acquire(index, *message[2:])
+        elif kind == "release":
+            self._release(index, message[2])
+        elif kind == "pause":
+            scheduler.pause(message[2])
+        elif kind == "evaluate":
+            from evaluation_worker import evaluation_worker
+            evaluation_worker.enqueue(*message[2:])
+
+    def _acquire(self, index, permit_id, priority, estimated_tokens):
+        requests = self.requests[index]
+
+        async def grant():
+            await scheduler.acquire(Priority(priority), estimated_tokens)
+            requests.put(("grant", permit_id))
+        self.permits[(index, permit_id)] = asyncio.create_task(grant())
+
+    def _release(self, index, permit_id):
+        task = self.permits.pop((index, permit_id), None)
+        if task is None:
+            return
+        if not task.done():
+            # Se il turno era appena stato concesso, OpenAIScheduler.acquire lo restituisce
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            scheduler.release()
+
+    def _release_permits(self, index):
+        # I permessi di un worker terminato non verrebbero mai restituiti
+        for shard, permit_id in list(self.permits):
+            if shard == index:
+                self._release(shard, permit_id)
+
+    def _resolve(self, index, request_id, ok, result):
+        entry = self.pending.pop(request_id, None)
+        if entry is None or entry[1].done():
+            return
+        if ok:
+            entry[1].set_result(result)
+        else:
+            entry[1].set_exception(RemoteCallError(result))
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(Config.SHARD_HEALTH_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f"Worker {index} terminato (codice {process.exitcode}), riavvio.")
+                    self.restarts += 1
+                    self._fail_pending(index)
+                    self._release_permits(index)
+                    self._spawn(index)
+
+    def _fail_pending(self, index):
+        for request_id, (shard, future) in list(self.pending.items()):
+            if shard == index:
+                self.pending.pop(request_id)
+                if not future.done():
+                    future.set_exception(ShardUnavailableError(f"Worker {index} non disponibile"))
+
+    async def _request(self, chat_id, *payload):
+        index = shard_for(chat_id, self.workers)
+        # La priorità corrente (es. DAILY nei riassunti giornalieri) viaggia con la richiesta
+        priority = int(current_priority.get())
+        # Ripete la richiesta se il worker termina prima di rispondere (dopo il riavvio)
+        for attempt in range(Config.SHARD_MAX_ATTEMPTS):
+            request_id = next(self.request_ids)
+            future = self.loop.create_future()
+            self.pending[request_id] = (index, future)
+            self.requests[index].put((payload[0], request_id, chat_id, priority, *payload[1:]))
+            try:
+                return await future
+            except ShardUnavailableError:
+                if attempt == Config.SHARD_MAX_ATTEMPTS - 1:
+                    raise
+                logger.warning(f"Richiesta per la chat {chat_id} ripetuta dopo il riavvio del worker {index}.")
+
+    async def dispatch(self, chat_id, data):
+        """Elabora un update nel worker della chat e attende che sia completato."""
+        return await self._request(chat_id, "update", data)
+
+    async def call(self, chat_id, method, *args):
+        return await self._request(chat_id, "call", method, args)
+
+    async def stop(self):
+        if not self.processes:
+            return
+        if self.monitor_task:
+            self.monitor_task.cancel()
+        for queue in self.requests:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, Config.SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self.replies.put(None)
+        self.processes = []
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self.processes),
+            "in_flight": len(self.pending),
+            "openai_permits": len(self.permits),
+            "restarts": self.restarts,
+        }
+
+
+class RemoteSession:
+    """Sessione di una chat posseduta da un worker: i metodi asincroni vengono eseguiti nel worker."""
+
+    def __init__(self, router, chat_id):
+        self.router = router
+        self.chat_id = chat_id
+
+    def __getattr__(self, name):
+        if name not in REMOTE_METHODS:
+            raise AttributeError(name)
+
+        async def remote_method(*args):
+            return await self.router.call(self.chat_id, name, *args)
+        return remote_method
+
+
+class RemoteSessionManager:
+    """Stessa interfaccia di SessionManager usata da bot e webhook, con le sessioni nei worker."""
+
+    def __init__(self, router):
+        self.router = router
+
+    async def get_session(self, chat_id):
+        return RemoteSession(self.router, chat_id)
+
+    async def get_daily_schedules(self):
+        # Le preferenze vengono salvate alla creazione della sessione e a ogni modifica: il database è aggiornato
+        from async_database import get_daily_schedules
+        return await get_daily_schedules()
+
+    def stats(self):
+        return {"sharded": self.router.stats()}
+
+
+shard_router = ShardRouter()
+
+
+def get_session_manager():
+    """SessionManager locale, o il suo proxy verso i worker quando SHARD_WORKERS > 0."""
+    if shard_router.enabled:
+        return RemoteSessionManager(shard_router)
+    from session_manager import SessionManager
+    return SessionManager()
@@ -0,0 +1,62 @@
+# smoke_check.py
+
+import builtins
+import glob
+import os
+import symtable
+import sys
+
+# Nomi definiti dall'interprete in ogni modulo
+MODULE_NAMES = {"__name__", "__file__", "__doc__", "__spec__", "__loader__", "__package__", "__builtins__"}
+
+
+def module_names(table):
+    """Nomi legati a livello di modulo: import, def, class, assegnamenti e 'global' nelle funzioni."""
+    names = {symbol.get_name() for symbol in table.get_symbols() if symbol.is_assigned() or symbol.is_imported()}
+    for child in _children(table):
+        names.update(symbol.get_name() for symbol in child.get_symbols()
+                     if symbol.is_declared_global() and symbol.is_assigned())
+    return names
+
+
+def _children(table):
+    for child in table.get_children():
+        yield child
+        yield from _children(child)
+
+
+def undefined_names(path):
+    """Nomi globali letti nel modulo (anche dentro le funzioni) che non sono definiti da nessuna parte."""
+    with open(path, encoding="utf-8") as source_file:
+        source = source_file.read()
+    table = symtable.symtable(source, path, "exec")
+    if "*" in {symbol.get_name() for symbol in table.get_symbols()}:
+        return []  # 'from x import *': i nomi non sono noti staticamente
+    known = module_names(table) | MODULE_NAMES | set(dir(builtins))
+    missing = set()
+    for scope in [table, *_children(table)]:
+        for symbol in scope.get_symbols():
+            if symbol.is_referenced() and (scope is table or symbol.is_global()) and symbol.get_name() not in known:
+                missing.add(symbol.get_name())
+    return sorted(missing)
+
+
+def check(root="."):
+    errors = []
+    for path in sorted(glob.glob(os.path.join(root, "*.py"))):
+        try:
+            missing = undefined_names(path)
+        except SyntaxError as e:
+            errors.append(f"{path}: errore di sintassi: {e}")
+            continue
+        errors.extend(f"{path}: nome non definito '{name}'" for name in missing)
+    return errors
+
+
+if __name__ == "__main__":
+    # Controllo statico: non importa i moduli, quindi non servono le dipendenze installate
+    problems = check(os.path.dirname(os.path.abspath(__file__)))
+    for problem in problems:
+        print(problem)
+    print(f"Problemi trovati: {len(problems)}." if problems else "Nessun nome non definito.")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,74 @@
+# startup.py
+
+import asyncio
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+from tabulate import tabulate
+
+# Configurazione del logger
+logger = logging.getLogger("startup")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Moduli pesanti caricati solo al primo utilizzo (o durante il warm-up)
+HEAVY_MODULES = [
+    "openai",
+    "cv2",
+    "moviepy.editor",
+    "unstructured.partition.auto",
+]
+
+
+class StartupProfiler:
+    """Misura la durata delle fasi di avvio e i pacchetti importati in ciascuna."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        modules_before = set(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            new_packages = sorted({module.split(".")[0] for module in set(sys.modules) - modules_before})
+            self.phases.append((name, elapsed, new_packages))
+
+    def report(self):
+        total = time.perf_counter() - self.started_at
+        data = [
+            [name, f"{elapsed:.3f}", ", ".join(packages[:8]) + (" ..." if len(packages) > 8 else "")]
+            for name, elapsed, packages in self.phases
+        ]
+        data.append(["Totale", f"{total:.3f}", ""])
+        logger.info("Tempi di avvio:\n" + tabulate(data, headers=["Fase", "Secondi", "Pacchetti importati"]))
+
+
+profiler = StartupProfiler()
+
+
+def _import_heavy_modules():
+    import importlib
+    for module_name in HEAVY_MODULES:
+        with profiler.phase(f"warm-up {module_name}"):
+            try:
+                importlib.import_module(module_name)
+            except ImportError as e:
+                logger.warning(f"Impossibile pre-caricare '{module_name}': {e}")
+
+
+async def warm_up():
+    """Pre-carica le dipendenze pesanti in un thread, mentre il server accetta già richieste."""
+    from evaluation_worker import evaluation_worker
+
+    start = time.perf_counter()
+    await asyncio.to_thread(_import_heavy_modules)
+    await evaluation_worker.warm_up()
+    logger.info(f"Warm-up completato in {time.perf_counter() - start:.3f} s.")
+    profiler.report()
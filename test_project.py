@@ -1,24 +1,32 @@
 #test_project.py
 import asyncio
 
-import matplotlib.pyplot as plt
-from bert_score import score
-from rouge_score import rouge_scorer
+from bert_scorer import get_bert_scorer
 from tabulate import tabulate
-import openai
-import spacy
 
 import time
 import tracemalloc
 
-# Carica il modello di lingua italiana di spaCy
-nlp = spacy.load("it_core_news_sm")
+# Modello di lingua italiana di spaCy, caricato al primo utilizzo
+_spacy_nlp = None
+
+
+def get_spacy_nlp():
+    global _spacy_nlp
+    if _spacy_nlp is None:
+        import spacy
+        _spacy_nlp = spacy.load("it_core_news_sm")
+    return _spacy_nlp
+
 
 class SummaryEvaluator:
-    def __init__(self, api_key):
-        openai.api_key = api_key
+    def __init__(self, api_key=None):
+        if api_key:
+            import openai
+            openai.api_key = api_key
 
-    async def evaluate_rouge(self, generated_summary, original_text):
+    def compute_rouge(self, generated_summary, original_text):
+        from rouge_score import rouge_scorer
         scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
         scores = scorer.score(original_text, generated_summary)
 
@@ -29,13 +37,12 @@ class SummaryEvaluator:
         }
         return rouge_f1_scores
 
-    async def evaluate_bert_score(self, generated_summary, original_text):
-        _, _, F1 = score([generated_summary], [original_text], lang="it")
-        return F1.mean().item()
+    def compute_bert_score(self, generated_summary, original_text):
+        return get_bert_scorer().score(generated_summary, original_text)
 
     def extract_keywords(self, text):
         """Estrae le parole chiave principali (sostantivi, aggettivi, verbi) da un testo."""
-        doc = nlp(text)
+        doc = get_spacy_nlp()(text)
         keywords = [token.lemma_ for token in doc if token.pos_ in {"NOUN", "ADJ", "VERB"}]
         return keywords
 
@@ -46,26 +53,51 @@ class SummaryEvaluator:
         union = len(set1.union(set2))
         return intersection / union if union != 0 else 0
 
-    async def evaluate_summary_keywords(self, generated_summary, original_text):
+    def compute_summary_keywords(self, generated_summary, original_text):
         """Valuta la similarità delle parole chiave tra riassunto e testo originale."""
         original_keywords = self.extract_keywords(original_text)
         summary_keywords = self.extract_keywords(generated_summary)
         return self.jaccard_similarity(original_keywords, summary_keywords)
 
+    def compute_all(self, generated_summary, original_text):
+        """Calcola tutte le metriche in modo sincrono (da eseguire fuori dall'event loop)."""
+        return {
+            "rouge": self.compute_rouge(generated_summary, original_text),
+            "bert_score": self.compute_bert_score(generated_summary, original_text),
+            "keywords_score": self.compute_summary_keywords(generated_summary, original_text),
+        }
+
+    def compute_all_batch(self, pairs):
+        """Come compute_all, ma calcola BERTScore per tutte le coppie in un unico forward pass."""
+        summaries = [generated_summary for generated_summary, _ in pairs]
+        originals = [original_text for _, original_text in pairs]
+        bert_scores = get_bert_scorer().score_batch(summaries, originals)
+        return [
+            {
+                "rouge": self.compute_rouge(generated_summary, original_text),
+                "bert_score": bert_score,
+                "keywords_score": self.compute_summary_keywords(generated_summary, original_text),
+            }
+            for (generated_summary, original_text), bert_score in zip(pairs, bert_scores)
+        ]
+
+    # Le varianti asincrone delegano il calcolo a un thread per non bloccare l'event loop
+    async def evaluate_rouge(self, generated_summary, original_text):
+        return await asyncio.to_thread(self.compute_rouge, generated_summary, original_text)
+
+    async def evaluate_bert_score(self, generated_summary, original_text):
+        return await asyncio.to_thread(self.compute_bert_score, generated_summary, original_text)
+
+    async def evaluate_summary_keywords(self, generated_summary, original_text):
+        return await asyncio.to_thread(self.compute_summary_keywords, generated_summary, original_text)
+
     async def run_all_tests(self, generated_summary, original_text):
-        # Crea le task per eseguire i vari test in parallelo
-        rouge_task = self.evaluate_rouge(generated_summary, original_text)
-        bert_task = self.evaluate_bert_score(generated_summary, original_text)
-        keywords_task = self.evaluate_summary_keywords(generated_summary, original_text)
-
-        # Esegui tutti i test e attendi i risultati
-        rouge_results, bert_results, keywords_score = await asyncio.gather(
-            rouge_task, bert_task, keywords_task
-        )
-
-        # Visualizza o salva i risultati
-        self.display_results(rouge_results, bert_results, keywords_score)
-        self.save_fidelity_report_tex(rouge_results, bert_results, keywords_score)
+        # Esegue tutti i test in un thread separato e attende i risultati
+        results = await asyncio.to_thread(self.compute_all, generated_summary, original_text)
+
+        # Visualizza i risultati
+        self.display_results(results["rouge"], results["bert_score"], results["keywords_score"])
+        return results
 
     def display_results(self, rouge_scores, bert_score, keywords_score):
         """Mostra i risultati F1 per ROUGE, BERT e la similarità delle parole chiave."""
@@ -0,0 +1,77 @@
+# tokenizer.py
+
+import logging
+
+# Configurazione del logger
+logger = logging.getLogger("tokenizer")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+# Codifica usata da gpt-4o / gpt-4o-mini
+ENCODING_NAME = "o200k_base"
+# Stima di caratteri per token quando tiktoken non è installato
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING_NAME)
+        except Exception as e:
+            logger.warning(f"tiktoken non disponibile ({e}), uso una stima dei token basata sui caratteri.")
+    return _encoding
+
+
+def count_tokens(text):
+    """Conta (o stima) localmente i token di un testo."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Tronca un testo al numero massimo di token indicato."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+def split_by_tokens(text, max_tokens):
+    """Divide un testo riga per riga in segmenti di al più max_tokens token, senza spezzare i messaggi."""
+    if max_tokens < 1:
+        raise ValueError(f"max_tokens deve essere almeno 1, ricevuto {max_tokens}")
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line) + 1
+        # Una singola riga troppo lunga viene spezzata a sua volta
+        while line_tokens > max_tokens:
+            # Almeno un carattere per iterazione, anche quando max_tokens - 1 è zero
+            head = truncate_to_tokens(line, max_tokens - 1) or line[:1]
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.append(head)
+            line = line[len(head):]
+            line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        if line:
+            current.append(line)
+            current_tokens += line_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
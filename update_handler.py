@@ -0,0 +1,85 @@
+# update_handler.py
+
+import logging
+
+from config import Config
+from http_client import get_http_client
+from models import parse_update
+from session_manager import SessionManager
+
+session_manager = SessionManager()
+
+# Configurazione del logger
+logger = logging.getLogger("update_handler")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+# Elaborazione di un update accodato dal webhook: usata dal processo principale o dai worker di shard_router
+async def handle_update(chat_id, data):
+    message = parse_update(data).message
+    user = message.from_user
+    if user and user.username:
+        username = user.username
+    elif user and (user.first_name or user.last_name):
+        username = " ".join(name for name in (user.first_name, user.last_name) if name)
+    else:
+        username = 'Sconosciuto'
+    # Gestione del messaggio
+    await process_message(message, username, chat_id)
+
+
+
+async def process_message(message, username, chat_id):
+    # Ottieni la sessione dell'utente
+    user_session = await session_manager.get_session(chat_id)
+    media_fields = ['photo', 'video', 'document', 'audio', 'voice', 'animation', 'sticker', 'video_note']
+    timestamp = message.date
+
+    if message.caption is not None:
+        caption = message.caption
+    else:
+        caption = ""
+
+    # Gestione dei messaggi di testo
+    if message.text and not message.text.startswith("/"):  # Ignora i comandi
+        await user_session.add_message(username, 'text', message.text, timestamp, caption)
+    else:
+        # Gestione dei media
+        for media_field in media_fields:
+            media = getattr(message, media_field, None)
+            if media:
+                if isinstance(media, list):  # Gestione delle foto (lista di Media)
+                    media = media[-1]  # Ottieni la risoluzione più alta
+
+                # Gestion tipi sticker
+                if media_field == 'sticker':
+                    if media.is_animated:
+                        media_field = 'video'
+                # Gestione tipi documento
+                if media_field == 'document':
+                    if media.mime_type.startswith('image'):
+                        media_field = 'photo'
+                    elif media.mime_type.startswith('video'):
+                        media_field = 'video'
+
+                file_url = await get_file_url(media.file_id)
+                if file_url:
+                    await user_session.add_message(username, media_field, file_url, timestamp, caption, media.file_unique_id)
+
+
+async def get_file_url(file_id):
+    response = await get_http_client().get(f"https://api.telegram.org/bot{Config.BOT_TOKEN}/getFile", params={"file_id": file_id})
+    if response.status_code == 200:
+        file_info = response.json()
+        if 'result' in file_info:
+            file_path = file_info['result'].get('file_path')
+            if file_path:
+                return f"https://api.telegram.org/file/bot{Config.BOT_TOKEN}/{file_path}"
+            else:
+                logger.error("'file_path' non trovato nella risposta di Telegram.")
+        else:
+            logger.error("'result' non trovato nella risposta di Telegram.")
+    else:
+        logger.error(f"Errore durante il recupero del file da Telegram: {response.status_code} - {response.text}")
+    return None
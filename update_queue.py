@@ -0,0 +1,173 @@
+# update_queue.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from config import Config
+from async_database import (add_pending_update, delete_pending_update, get_pending_updates, get_recent_update_ids,
+                            prune_seen_updates)
+
+# Configurazione del logger
+logger = logging.getLogger("update_queue")
+logger.setLevel(logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
+
+
+class QueueFullError(Exception):
+    """La coda della chat (o quella complessiva) è piena: l'update va rifiutato e ritentato da Telegram."""
+
+
+class RecentUpdates:
+    """Indice limitato degli update_id già ricevuti; la copia durevole è la tabella seen_updates."""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or Config.UPDATE_DEDUP_SIZE
+        self.ids = OrderedDict()
+        self.added = 0
+
+    async def load(self):
+        for update_id in await get_recent_update_ids(self.max_size):
+            self.ids[update_id] = None
+
+    def __contains__(self, update_id):
+        return update_id in self.ids
+
+    def add(self, update_id):
+        self.ids[update_id] = None
+        if len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+        self.added += 1
+
+    def discard(self, update_id):
+        self.ids.pop(update_id, None)
+
+    async def prune(self):
+        # La tabella viene ridotta di rado: ogni max_size nuovi update
+        if self.added >= self.max_size:
+            self.added = 0
+            await prune_seen_updates(self.max_size)
+
+
+class UpdateQueue:
+    """
+    Coda durevole degli update del webhook, con una coda per chat.
+
+    Ogni update viene salvato su SQLite prima della conferma a Telegram e rimosso dopo l'elaborazione,
+    così quelli rimasti in sospeso vengono ripresi al riavvio. Le chat con update in attesa sono in una
+    coda di chat pronte servita da un pool limitato di worker: una chat è in mano a un solo worker alla
+    volta, quindi i suoi messaggi restano in ordine, e dopo ogni update torna in fondo, così una chat
+    lenta non blocca quelle dietro di lei.
+    """
+
+    def __init__(self, handler, workers=None, max_size=None, max_total=None):
+        self.handler = handler  # coroutine function (chat_id, payload)
+        self.workers = workers or Config.UPDATE_WORKERS
+        self.max_size = max_size or Config.UPDATE_QUEUE_SIZE
+        self.max_total = max_total or Config.UPDATE_QUEUE_TOTAL
+        self.recent = RecentUpdates()
+        self.pending = {}  # chat_id -> deque di (row_id, payload, enqueued_at), finché la chat ha update
+        self.ready = None  # chat con update in attesa e nessun worker al lavoro su di esse
+        self.queued = 0
+        self.tasks = []
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.duplicates = 0
+
+    def _put(self, chat_id, row_id, payload):
+        chat_queue = self.pending.get(chat_id)
+        if chat_queue is None:
+            # La chat non è né pronta né in elaborazione: entra nella coda delle chat pronte
+            chat_queue = self.pending[chat_id] = deque()
+            self.ready.put_nowait(chat_id)
+        chat_queue.append((row_id, payload, time.monotonic()))
+        self.queued += 1
+
+    async def start(self):
+        self.ready = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self.recent.load()
+        # Riprende gli update confermati ma non elaborati prima dell'ultimo arresto
+        pending = await get_pending_updates()
+        for row_id, chat_id, payload in pending:
+            self._put(chat_id, row_id, payload)
+        if pending:
+            logger.info(f"Ripresi {len(pending)} update in sospeso.")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def enqueue(self, chat_id, payload, update_id=None):
+        """
+        Salva l'update e lo accoda. Restituisce False se l'update_id era già stato ricevuto;
+        solleva QueueFullError se la coda della chat o quella complessiva è piena.
+        """
+        if update_id is not None and update_id in self.recent:
+            self.duplicates += 1
+            return False
+        if len(self.pending.get(chat_id, ())) >= self.max_size or self.queued >= self.max_total:
+            self.rejected += 1
+            raise QueueFullError(f"Coda piena per la chat {chat_id}")
+
+        if update_id is not None:
+            # Registrato subito: una riconsegna concorrente viene scartata senza attendere il database
+            self.recent.add(update_id)
+        try:
+            row_id = await add_pending_update(chat_id, payload, update_id)
+        except Exception:
+            if update_id is not None:
+                self.recent.discard(update_id)
+            raise
+        if row_id is None:
+            # Già presente in seen_updates ma uscito dall'indice in memoria
+            self.duplicates += 1
+            return False
+        await self.recent.prune()
+        # Accodato anche se la coda si è riempita durante il salvataggio: l'update è già su disco
+        self._put(chat_id, row_id, payload)
+        return True
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            chat_queue = self.pending[chat_id]
+            row_id, payload, enqueued_at = chat_queue.popleft()
+            self.queued -= 1
+            try:
+                await self.handler(chat_id, payload)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Errore nell'elaborazione dell'update della chat {chat_id}: {e}")
+            finally:
+                # Un update alla volta per chat: la chat torna in fondo se ha altri update in attesa
+                if chat_queue:
+                    self.ready.put_nowait(chat_id)
+                else:
+                    del self.pending[chat_id]
+            # Anche gli update falliti vengono rimossi, altrimenti verrebbero ripetuti a ogni avvio
+            try:
+                await delete_pending_update(row_id)
+            except Exception as e:
+                # Un errore del database non deve terminare il worker: l'update verrà solo ripreso al riavvio
+                logger.error(f"Errore nella rimozione dell'update {row_id} della chat {chat_id}: {e}")
+            wait = time.monotonic() - enqueued_at
+            if wait > 10:
+                logger.warning(f"Update della chat {chat_id} elaborato dopo {wait:.1f}s in coda.")
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "chats": len(self.pending),
+            "max_chat": max((len(chat_queue) for chat_queue in self.pending.values()), default=0),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
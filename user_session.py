@@ -2,9 +2,11 @@
 
 import asyncio
 import logging
-from datetime import datetime
-from database import save_messages, save_chat_preferences, get_chat_preferences, add_summary
-from nlp import NLP
+from async_database import save_messages_bulk, save_chat_preferences, get_chat_preferences, add_summary, save_session_state, get_session_state, delete_session_state
+from config import Config
+from deadline_scheduler import deadline_scheduler
+from message_buffer import MessageBuffer, MessageRecord
+from nlp import get_nlp_service
 from test_project import eval
 from UC import UC as uc
 
@@ -13,26 +15,36 @@ class UserSession:
     def __init__(self, chat_id):
         # Identificatore della chat e impostazioni iniziali
         self.chat_id = chat_id
-        #self.messages = []  # Messaggi temporanei per l'analisi
+        self.current_summary = ""
 
-        self.messages,self.current_summary = [],""
-
-        self.daily_messages = []  # Messaggi giornalieri per il salvataggio nel database
+        # Unico buffer compatto: self.messages e self.daily_messages sono viste su di esso
+        self.buffer = MessageBuffer()
         self.preferences = {
             "Auto-Riassunto": True,
             "Lingua": "it",
             "Filtro": "",
             "Lunghezza Riassunto": "medio",
+            "Fuso Orario": Config.DEFAULT_TIMEZONE,
+            "Ora Riassunto": Config.DEFAULT_DAILY_HOUR,
         }
-        self.nlp = NLP()
+        self.nlp = get_nlp_service()  # Servizio NLP condiviso tra le chat
         self.max_time = 3 * 60  # Timer riassunto in secondi
         self.max_messages = 10  # Numero massimo di messaggi per riassunto
 
         # Gestione asincrona delle risorse
-        self.timer_task = None
         self.lock = asyncio.Lock()
         self.pending_filters = []
 
+    # Messaggi temporanei per l'analisi
+    @property
+    def messages(self):
+        return self.buffer.window()
+
+    # Messaggi giornalieri per il salvataggio nel database
+    @property
+    def daily_messages(self):
+        return self.buffer.unsaved()
+
     # Creazione asincrona dell'istanza UserSession
     @classmethod
     async def create(cls, chat_id):
@@ -40,43 +52,27 @@ class UserSession:
         await self.load_session()
         return self
 
-    # Timer per il riassunto automatico
+    # Timer per il riassunto automatico, gestito dallo scheduler condiviso delle scadenze
     async def start_timer(self):
-        if self.timer_task:
-            self.timer_task.cancel()
-        self.timer_task = asyncio.create_task(self._run_timer())
+        deadline_scheduler.schedule(self.chat_id, self.max_time, self._on_timer)
 
-    async def _run_timer(self):
-        start_time = datetime.now().timestamp()
-        try:
-            while True:
-                elapsed_time = datetime.now().timestamp() - start_time
-                if elapsed_time >= self.max_time:
-                    break
-                await asyncio.sleep(1)
+    def cancel_timer(self):
+        deadline_scheduler.cancel(self.chat_id)
+
+    async def _on_timer(self):
+        async with self.lock:
             await self.analyze_messages()
-        except asyncio.CancelledError:
-            pass
 
     # Aggiunta di un nuovo messaggio e gestione del limite di messaggi
-    async def add_message(self, username, message_type, content, timestamp, caption):
+    async def add_message(self, username, message_type, content, timestamp, caption, file_unique_id=None):
         async with self.lock:
             if await self.is_pending_filter(username):
                 return
 
-            message = {
-                'username': username,
-                'type': message_type,
-                'content': content,
-                'timestamp': datetime.fromtimestamp(timestamp),
-                'caption': caption
-            }
-            self.messages.append(message)
-            self.daily_messages.append(message)
+            self.buffer.append(MessageRecord(username, message_type, content, timestamp, caption, file_unique_id))
 
             if len(self.messages) >= self.max_messages:
-                if self.timer_task:
-                    self.timer_task.cancel()
+                self.cancel_timer()
                 await self.analyze_messages()
             else:
                 await self.start_timer()
@@ -88,36 +84,74 @@ class UserSession:
             return
         eval.start("Summarizer")
         try:
-            result = await self.nlp.process_messages(self.messages, self.current_summary, self.preferences)
+            messages = self.messages
+            result = await self.nlp.process_messages(messages, self.current_summary, self.preferences, self.chat_id)
             eval.stop("Summarizer")
             eval.print_results()
 
             self.current_summary = result
-            self.messages = []
+            # Solo i messaggi riassunti escono dalla finestra: quelli arrivati nel frattempo restano
+            self.buffer.close_window(len(messages))
         except Exception as e:
             logging.error(f"Errore durante l'analisi dei messaggi: {e}")
 
     # Restituisce il riassunto corrente
     async def get_summary(self):
-        if self.timer_task:
-            self.timer_task.cancel()
+        self.cancel_timer()
         if len(self.messages)>0:
             await self.analyze_messages()
         if self.current_summary == "":
             return "Non c'è niente da riassumere" 
         return self.current_summary
 
-    # Carica le preferenze della chat dal database
+    # Carica le preferenze della chat e l'eventuale stato salvato alla rimozione dalla memoria
     async def load_session(self):
-        db_preferences = get_chat_preferences(self.chat_id)
+        db_preferences = await get_chat_preferences(self.chat_id)
         if db_preferences:
             self.preferences.update(db_preferences)
+        else:
+            # Chat nuova: le preferenze predefinite vengono salvate subito, così la pianificazione dei
+            # riassunti giornalieri (che legge il database) la vede anche se resta in un worker
+            await self.save_preferences()
+
+        # Lo stato salvato resta nel database finché la sessione non è installata (vedi activate)
+        state = await get_session_state(self.chat_id)
+        if state:
+            self.current_summary = state['current_summary']
+            # I messaggi in attesa sono già nel database: tornano solo nella finestra da riassumere
+            self.buffer.restore_window([MessageRecord.from_dict(message) for message in state['pending_messages']])
+
+    # Chiamata dal SessionManager dopo aver installato la sessione: lo stato ricaricato non serve più
+    async def activate(self):
+        async with self.lock:
+            await delete_session_state(self.chat_id)
+            if self.messages:
+                await self.start_timer()
+
+    # Persiste la sessione prima che venga rimossa dalla memoria
+    async def evict(self):
+        async with self.lock:
+            self.cancel_timer()
+            # I messaggi giornalieri vanno subito nel database, quelli in attesa nello stato della sessione
+            await self.save_session()
+            await save_session_state(self.chat_id, self.current_summary, self.messages)
+
+    # Salvataggio periodico di una sessione residente: un arresto non ordinato perde solo i messaggi successivi
+    async def checkpoint(self):
+        async with self.lock:
+            await self.save_session()
+            await save_session_state(self.chat_id, self.current_summary, self.messages)
 
     # Salvataggio dei messaggi e delle preferenze della sessione
     async def save_session(self):
-        for message in self.daily_messages:
-            save_messages(self.chat_id, message['username'], message['content'], message['type'], message['timestamp'], message['caption'])
-        save_chat_preferences(self.chat_id, self.preferences["Auto-Riassunto"], self.preferences["Lingua"], self.preferences["Filtro"], self.preferences["Lunghezza Riassunto"])
+        # Copia dei messaggi: quelli ricevuti durante il salvataggio restano nel buffer
+        saved = await save_messages_bulk(self.chat_id, list(self.daily_messages))
+        self.buffer.mark_persisted(saved)
+        await self.save_preferences()
+        return saved
+
+    async def save_preferences(self):
+        await save_chat_preferences(self.chat_id, self.preferences["Auto-Riassunto"], self.preferences["Lingua"], self.preferences["Filtro"], self.preferences["Lunghezza Riassunto"], self.preferences["Fuso Orario"], self.preferences["Ora Riassunto"])
 
     # Salvataggio e riassunto giornaliero
     async def daily_store(self):
@@ -125,12 +159,11 @@ class UserSession:
         await self.save_session()
         if len(self.messages)>0:
             await self.analyze_messages()
-        add_summary(self.chat_id, self.current_summary)
+        await add_summary(self.chat_id, self.current_summary)
 
         eval.stop("Database")
         eval.print_results()
 
-        self.daily_messages = []
         logging.info(f"Riassunto giornaliero per chat {self.chat_id} salvato.")
 
     # Gestione dei filtri in sospeso
@@ -153,6 +186,8 @@ class UserSession:
         async with self.lock:
             if key in self.preferences:
                 self.preferences[key] = value
+                # Salvate subito: sono lette anche da altri processi (pianificazione, worker)
+                await self.save_preferences()
             else:
                 logging.warning(f"Tentativo di aggiornamento di una preferenza non esistente: '{key}'")
 
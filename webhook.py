@@ -2,17 +2,23 @@
 
 import logging
 
-import httpx
-import requests
 from config import Config
-from models import Update
+from deadline_scheduler import deadline_scheduler
+from document_extractor import document_extractor
+from evaluation_worker import evaluation_worker
+from http_client import get_http_client
+from media_cache import media_cache
+from models import decode_update
+from openai_scheduler import scheduler
 from pyngrok import ngrok
 from quart import Quart, request, jsonify
-from session_manager import SessionManager
+from shard_router import get_session_manager, shard_router
+from update_handler import handle_update
+from update_queue import QueueFullError, UpdateQueue
 
 app = Quart(__name__)
 
-session_manager = SessionManager()
+session_manager = get_session_manager()
 
 # Configurazione del logger
 logger = logging.getLogger("webhook")
@@ -20,11 +26,11 @@ logger.setLevel(logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
 
 
-def set_webhook():
+async def set_webhook():
     public_url = ngrok.connect(8000, bind_tls=True).public_url
     webhook_url = f"{public_url}/webhook"
-    
-    response = requests.post(
+
+    response = await get_http_client().post(
         f"https://api.telegram.org/bot{Config.BOT_TOKEN}/setWebhook",
         json={"url": webhook_url}
     )
@@ -49,81 +55,68 @@ async def handle_error(error):
     return jsonify({"error": error_message}), status_code
 
 
+# Statistiche di componenti creati fuori da questo modulo (es. dal bot), registrate all'avvio
+metrics_providers = {}
+
+
+def register_metrics(name, provider):
+    metrics_providers[name] = provider
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return jsonify({
+        **{name: provider() for name, provider in metrics_providers.items()},
+        "openai_scheduler": scheduler.stats(),
+        "evaluation": evaluation_worker.stats(),
+        "media_cache": media_cache.stats(),
+        "documents": document_extractor.stats(),
+        "sessions": session_manager.stats(),
+        "auto_summary_deadlines": deadline_scheduler.stats(),
+        "updates": update_queue.stats(),
+    })
+
+
 @app.route('/webhook', methods=['POST'])
-async def webhook(): 
+async def webhook():
+    # Valida, accoda e conferma subito: l'elaborazione avviene nei worker di update_queue
     try:
-        data = await request.json
-        update = Update(**data)
-
-        if update.message:
-            message = update.message
-            chat_id = message.chat.id
-            if message.from_user.username:
-                username = message.from_user.username
-            elif message.from_user.first_name or message.from_user.last_name:
-                username = message.from_user.first_name + " " + message.from_user.last_name
-            else:
-                username = 'Sconosciuto'
-            # Gestione del messaggio
-            await process_message(message, username, chat_id)
+        update, data = decode_update(await request.get_data())
+    except Exception as e:
+        logger.error(f"Update non valido: {e}")
+        return '', 400
 
+    if not update.message or not update.message.chat or update.message.chat.id is None:
         return '', 200
+
+    try:
+        if not await update_queue.enqueue(update.message.chat.id, data, update.update_id):
+            logger.info(f"Update {update.update_id} già ricevuto, scartato.")
+    except QueueFullError as e:
+        logger.warning(f"{e}: update {update.update_id} rifiutato.")
+        return '', 503, {"Retry-After": str(Config.UPDATE_RETRY_AFTER)}
     except Exception as e:
         logger.error(f"Errore nel webhook: {e}")
         return '', 500
+    return '', 200
 
 
-async def process_message(message, username, chat_id):
-    # Ottieni la sessione dell'utente
-    user_session = await session_manager.get_session(chat_id)
-    media_fields = ['photo', 'video', 'document', 'audio', 'voice', 'animation', 'sticker', 'video_note']
-    timestamp = message.date
-
-    if message.caption is not None:
-        caption = message.caption
+async def dispatch_update(chat_id, data):
+    # Con SHARD_WORKERS > 0 l'update viene elaborato dal worker che possiede la chat
+    if shard_router.enabled:
+        await shard_router.dispatch(chat_id, data)
     else:
-        caption = ""
+        await handle_update(chat_id, data)
 
-    # Gestione dei messaggi di testo
-    if message.text and not message.text.startswith("/"):  # Ignora i comandi
-        await user_session.add_message(username, 'text', message.text, timestamp, caption)
-    else:
-        # Gestione dei media
-        for media_field in media_fields:
-            media = getattr(message, media_field, None)
-            if media:
-                if isinstance(media, list):  # Gestione delle foto (lista di Media)
-                    media = media[-1]  # Ottieni la risoluzione più alta
-
-                # Gestion tipi sticker
-                if media_field == 'sticker':
-                    if media.is_animated:
-                        media_field = 'video'
-                # Gestione tipi documento
-                if media_field == 'document':
-                    if media.mime_type.startswith('image'):
-                        media_field = 'photo'
-                    elif media.mime_type.startswith('video'):
-                        media_field = 'video'
-
-                file_url = await get_file_url(media.file_id)
-                if file_url:
-                    await user_session.add_message(username, media_field, file_url, timestamp, caption)
-
-
-async def get_file_url(file_id):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"https://api.telegram.org/bot{Config.BOT_TOKEN}/getFile?file_id={file_id}")
-        if response.status_code == 200:
-            file_info = response.json()
-            if 'result' in file_info:
-                file_path = file_info['result'].get('file_path')
-                if file_path:
-                    return f"https://api.telegram.org/file/bot{Config.BOT_TOKEN}/{file_path}"
-                else:
-                    logger.error("'file_path' non trovato nella risposta di Telegram.")
-            else:
-                logger.error("'result' non trovato nella risposta di Telegram.")
-        else:
-            logger.error(f"Errore durante il recupero del file da Telegram: {response.status_code} - {response.text}")
-        return None
+
+update_queue = UpdateQueue(dispatch_update)
+
+
+@app.before_serving
+async def start_update_queue():
+    await update_queue.start()
+
+
+@app.after_serving
+async def stop_update_queue():
+    await update_queue.stop()